@@ -1,21 +1,15 @@
-from BikeShare.data import BikeData
-from BikeShare.predict import BikeShareModel
-from BikeShare.calendar import is_holiday
-from azstorage import AzureStorage
+from BikeShare.data import BikeData, to_data_time
+from BikeShare.predict import BikeShareModel, feature_columns
+from BikeShare.backtest import Backtest
+from BikeShare.render import PlotRenderer, RenderUnavailable
 from weather import Weather
 import pandas as pd
 import numpy as np
-import os, uuid, tempfile, shutil
+import asyncio, hashlib, os, uuid, tempfile, shutil
 
-import matplotlib
-# Setting matplotlib backend to prevent conflict with Flask
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-
-import seaborn as sns
 import datetime as dt
 from flask import url_for
+from http_cache import forecast_validators, plot_cache_control
 
 import logging
 
@@ -23,44 +17,136 @@ logger = logging.getLogger('bike-share-predict')
 
 temp_dir = tempfile.gettempdir()
 
+# Scenario sweep limits and the rows scored per model batch
+max_scenario_values = 1000
+max_scenarios = 50000
+scenario_batch_size = 65536
+
+# Default scenario values, matching the defaults of the prediction form
+scenario_defaults = {'hitemp': '50.0', 'wind': '5.0', 'rain': '0.0', 'snow': '0.0'}
+
+# Supported export formats and their mimetypes
+export_formats = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+# Write-only file object handed to the parquet writer
+# Collects the written bytes so they can be streamed out after each row group
+class _StreamBuffer:
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    # Return and clear the bytes written since the last call
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
 class BikeShareApi():
        
     # Initialize API
     def __init__(self, data_file, model_path, weather_api_key, 
-            storage_url=None, data_container_name=None, img_container_name=None):
+            storage_url=None, data_container_name=None, img_container_name=None,
+            render_workers=2, render_timeout=10.0, render_queue_depth=8, blob_cache_dir=None,
+            storage_connection_string=None, weather_api_url=None):
+        # Start plot rendering processes before the ML model is loaded
+        self.renderer = PlotRenderer(workers=render_workers,
+                                     timeout=render_timeout,
+                                     queue_depth=render_queue_depth)
+        self.renderer.start()
+        # Version of the templates of the pages embedding a plot. Set by the application
+        self.page_version = ''
+
         # Configure weather API connection
-        self.weather = Weather(weather_api_key)
+        if weather_api_url is None:
+            self.weather = Weather(weather_api_key)
+        else:
+            self.weather = Weather(weather_api_key, api_url=weather_api_url)
 
         # Create ML data model object for predictions
         self.model = BikeShareModel(model_path)
 
         # If no Azure storage information provided default to local storage
-        if storage_url is None:
+        if storage_url is None and storage_connection_string is None:
             self.storage_type = 'local'
         # Else configure Azure storage
         else:
             self.storage_type = 'azure'
+            # Only import the Azure SDK when Azure storage is configured
+            from azstorage import AzureStorage
             logger.info('Initializing the BikeShare data. Purging old graph images from Azure Storage...')
             # Configure Azure Storage connection for image files
-            self.img_storage = AzureStorage(storage_url, img_container_name)
+            self.img_storage = AzureStorage(storage_url, img_container_name, storage_connection_string)
             # Purge all old messages
             self.img_storage.clear_storage()
             
             # Configure Azure Storage connection and download data file
-            self.data_storage = AzureStorage(storage_url, data_container_name)
-            self.data_storage.download_blob(source_file=data_file, 
-                        destination_file=data_file, 
-                        destination_folder=temp_dir)
-            data_file = os.path.join(temp_dir, data_file)
+            self.data_storage = AzureStorage(storage_url, data_container_name, storage_connection_string)
+            if blob_cache_dir is None:
+                self.data_storage.download_blob(source_file=data_file, 
+                            destination_file=data_file, 
+                            destination_folder=temp_dir)
+                data_file = os.path.join(temp_dir, data_file)
+            # Only transfer the data file if it changed since it was cached
+            else:
+                data_file = self.data_storage.download_blob_cached(source_file=data_file,
+                            cache_dir=blob_cache_dir)
         
         # Create historical data object
         self.data = BikeData(summary_file=data_file)
+        # Scores the model against the historical data
+        self.backtest = Backtest(self.data, self.model)
+
+        # Builds URLs for plots in the static folder. Replaced when serving with Quart
+        self.url_for = url_for
+        # Async Azure Storage clients, created by start_async when serving with asyncio
+        self.storage_url = storage_url
+        self.storage_connection_string = storage_connection_string
+        self.data_container_name = data_container_name
+        self.img_container_name = img_container_name
+        self.async_img_storage = None
+        self.async_data_storage = None
+
+    # Create the async clients used when serving with asyncio. Must be called from the event loop
+    async def start_async(self):
+        if self.storage_type == 'azure':
+            from azstorage_aio import AsyncAzureStorage
+            self.async_img_storage = AsyncAzureStorage(self.storage_url, self.img_container_name,
+                                                       self.storage_connection_string)
+            self.async_data_storage = AsyncAzureStorage(self.storage_url, self.data_container_name,
+                                                        self.storage_connection_string)
+
+    # Close the async clients
+    async def close_async(self):
+        await self.weather.close()
+        for storage in [self.async_img_storage, self.async_data_storage]:
+            if storage is not None:
+                await storage.close()
 
     # Generate values for prediction based on submitted form values
     def get_predict_form_values(self, form):
         date = (dt.datetime.strptime(form['date'], '%Y-%m-%d')).date()
         
         # check if date is a holiday
+        from BikeShare.calendar import is_holiday
         holiday = float(is_holiday(date))
         month = date.month
 
@@ -107,6 +193,45 @@ class BikeShareApi():
 
         return values
 
+    # Return the retrieval time of the cached forecast for the selected day or None if not cached
+    def get_forecast_time(self, day = 1):
+        return self.weather.get_forecast_time(day)
+
+    # Return the validators of tomorrow's forecast page or None if no forecast is cached
+    def get_forecast_validators(self):
+        # The predictions plotted on the page also depend on the model version
+        etag, last_modified = forecast_validators(self.weather.get_cached_forecast(1), self.model.version)
+        if etag is None:
+            return None, None
+
+        return self.__plot_validators(etag, last_modified)
+
+    # Return the validators of a data visualization page
+    def get_visuals_validators(self, type, subtype):
+        # The model accuracy plot also depends on the model version
+        etag = self.data.etag('visuals', type, subtype, self.model.version)
+        return self.__plot_validators(etag, self.data.last_modified)
+
+    # Pages embedding a plot also change with their templates. Their plots are named after
+    # the page validator, so any worker can check the plot of a cached page is still stored
+    def __plot_validators(self, etag, last_modified):
+        return hashlib.md5(f"{etag}|{self.page_version}".encode()).hexdigest(), last_modified
+
+    # Return the URL of the plot of the page with the validator etag or None if it isn't stored
+    # Plots are purged when the service starts with Azure storage
+    def get_stored_plot(self, etag):
+        filename = etag + '.png'
+        if self.storage_type == 'azure':
+            return self.img_storage.get_blob_url(filename)
+        elif os.path.exists(self.__static_file(filename)):
+            return self.url_for('static', filename=self.__static_name(filename))
+        return None
+
+    async def get_stored_plot_async(self, etag):
+        if self.storage_type == 'azure':
+            return await self.async_img_storage.get_blob_url(etag + '.png')
+        return self.get_stored_plot(etag)
+
     # Dynamically generate values to submit for prediction based on a # of days from the current day
     # Can only generate up to a week in advance due to limited forecast availability
     def get_predict_values(self, day = 1):
@@ -116,52 +241,149 @@ class BikeShareApi():
         else:
             # Get forecasted weather values
             forecast = self.weather.get_daily_forecast(day)
-            
-            # Get date x days from today (0-7)
-            date = dt.date.today() + dt.timedelta(days=day)
-            
-            # check if date is a holiday
-            holiday = float(is_holiday(date))
-            month = date.month
+            return self.__get_forecast_values(forecast, day)
 
-            # set boolean for weekend    
-            if date.weekday() > 4:
-                weekend = 1
-            else:
-                weekend = 0
-
-            hours = np.arange(0,24,1)        
-            values = pd.DataFrame()
-            values['Hour'] = hours
-            values['Hi temp'] = forecast['temp_max']
-            values['Weekend'] = weekend
-            values['Year'] = date.year
-            values['Month'] = month
-            # Set season one-hot variables
-            seasons = ['Fall','Spring','Summer','Winter']
-            for col in seasons:
-                values[col] = 0
-            if month in [1,2,12]:
-                values['Winter'] = 1
-            elif month in[3,4,5]:
-                values['Spring'] = 1
-            elif month in [6,7,8]:
-                values['Summer'] = 1
-            elif month in[9,10,11]:
-                values['Fall'] = 1
-
-            values['Holiday'] = holiday
-            values['Wind'] = forecast['wind_speed']
-            values['Rain'] = forecast['rain']
-            # Set boolean flag for snow
-            if forecast['snow'] > 0:
-                values['Snow'] = 1
-            else:
-                values['Snow'] = 0
-            
+    # Generate values for prediction from the weather forecast without blocking the event loop
+    async def get_predict_values_async(self, day = 1):
+        forecast = await self.weather.get_daily_forecast_async(day)
+        return self.__get_forecast_values(forecast, day)
+
+    # Generate values for prediction from the weather forecast for the day
+    def __get_forecast_values(self, forecast, day):
+        # Get date x days from today (0-7)
+        date = dt.date.today() + dt.timedelta(days=day)
+        
+        # check if date is a holiday
+        from BikeShare.calendar import is_holiday
+        holiday = float(is_holiday(date))
+        month = date.month
+
+        # set boolean for weekend    
+        if date.weekday() > 4:
+            weekend = 1
+        else:
+            weekend = 0
+
+        hours = np.arange(0,24,1)        
+        values = pd.DataFrame()
+        values['Hour'] = hours
+        values['Hi temp'] = forecast['temp_max']
+        values['Weekend'] = weekend
+        values['Year'] = date.year
+        values['Month'] = month
+        # Set season one-hot variables
+        seasons = ['Fall','Spring','Summer','Winter']
+        for col in seasons:
+            values[col] = 0
+        if month in [1,2,12]:
+            values['Winter'] = 1
+        elif month in[3,4,5]:
+            values['Spring'] = 1
+        elif month in [6,7,8]:
+            values['Summer'] = 1
+        elif month in[9,10,11]:
+            values['Fall'] = 1
 
-            return values
+        values['Holiday'] = holiday
+        values['Wind'] = forecast['wind_speed']
+        values['Rain'] = forecast['rain']
+        # Set boolean flag for snow
+        if forecast['snow'] > 0:
+            values['Snow'] = 1
+        else:
+            values['Snow'] = 0
+        
+
+        return values
     
+    # Predict daily ride totals for every combination of the weather ranges on the given date
+    # Ranges are a single value or start:stop:step with an inclusive stop.
+    # All scenarios are built as one feature array and scored in a few large batches
+    def get_scenario_grid(self, date, hitemp=None, wind=None, rain=None, snow=None):
+        try:
+            date = dt.datetime.strptime(date or '', '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError("date must be in YYYY-MM-DD format")
+
+        axes = dict(hitemp=hitemp, wind=wind, rain=rain, snow=snow)
+        for name, value in axes.items():
+            axes[name] = self.__parse_range(name, value or scenario_defaults[name])
+
+        scenarios = int(np.prod([len(values) for values in axes.values()]))
+        if scenarios > max_scenarios:
+            raise ValueError(f"{scenarios} scenarios requested. Maximum is {max_scenarios}")
+
+        # Snow is a boolean feature so only score the distinct snow flags
+        snow_flags, snow_index = np.unique(axes['snow'] > 0, return_inverse=True)
+
+        # Build the cartesian product of the scenarios and 24 hours
+        grid = np.meshgrid(axes['hitemp'], axes['wind'], axes['rain'],
+                           snow_flags.astype(float), np.arange(0, 24),
+                           indexing='ij')
+        shape = grid[0].shape
+
+        from BikeShare.calendar import is_holiday
+        month = date.month
+        date_features = {
+            'Weekend': float(date.weekday() > 4),
+            'Year': date.year,
+            'Month': month,
+            'Fall': float(month in [9,10,11]),
+            'Spring': float(month in [3,4,5]),
+            'Summer': float(month in [6,7,8]),
+            'Winter': float(month in [1,2,12]),
+            'Holiday': float(is_holiday(date))
+        }
+        features = np.empty((grid[0].size, len(feature_columns)), dtype=np.float32)
+        for column, value in date_features.items():
+            features[:, feature_columns.index(column)] = value
+        for column, values in zip(['Hi temp', 'Wind', 'Rain', 'Snow', 'Hour'], grid):
+            features[:, feature_columns.index(column)] = values.ravel()
+
+        predictions = self.model.predict(features, batch_size=scenario_batch_size)
+        # Round each hour as in get_predictions and total the hours of each scenario
+        predictions = np.rint(predictions.clip(min=0)).reshape(shape)
+        totals = predictions.sum(axis=-1)[:, :, :, snow_index]
+        # Extreme weather values can push the model's output past what an int can hold
+        if not np.isfinite(totals).all() or totals.max(initial=0) >= 2.0 ** 63:
+            raise ValueError("Scenario values are outside the range the model can predict")
+        totals = totals.astype(int)
+
+        return {
+            'date': str(date),
+            'dimensions': list(axes),
+            'axes': {name: values.tolist() for name, values in axes.items()},
+            'scenarios': scenarios,
+            'totals': totals.tolist()
+        }
+
+    # Parse a single value or an inclusive start:stop:step range into an array
+    def __parse_range(self, name, value):
+        try:
+            parts = [float(part) for part in value.split(':')]
+        except ValueError:
+            raise ValueError(f"{name} must be a number or start:stop:step")
+        if not np.isfinite(parts).all():
+            raise ValueError(f"{name} values must be finite numbers")
+        # Values are scored by the model as float32
+        if (np.abs(parts) > np.finfo(np.float32).max).any():
+            raise ValueError(f"{name} values are out of range")
+
+        if len(parts) == 1:
+            values = np.array(parts)
+        elif len(parts) == 3 and parts[2] > 0 and parts[1] >= parts[0]:
+            start, stop, step = parts
+            # Checked as a float as the number of steps can be too large for an int
+            steps = np.floor((stop - start) / step + 1e-9)
+            if not steps < max_scenario_values:
+                raise ValueError(f"{name} range has more than {max_scenario_values} values")
+            count = int(steps) + 1
+            values = np.round(start + step * np.arange(count), 6)
+        else:
+            raise ValueError(f"{name} must be a number or start:stop:step with stop >= start and step > 0")
+
+        return values
+
     # Update dataframe with submitted values
     def update_data_values(self, form, timestamp):
         rides = int(form['Ride count'])
@@ -196,11 +418,95 @@ class BikeShareApi():
             file_loc = temp_path 
 
         return file_loc
+
+    # Save dataframe to a CSV file without blocking the event loop
+    async def save_data_values_async(self):
+        if self.storage_type != 'azure':
+            return await asyncio.get_running_loop().run_in_executor(None, self.save_data_values)
+
+        time_format='%Y-%m-%dT%H.%M.%S'
+        timestamp = dt.datetime.now().strftime(time_format)
+        temp_file = f"updated-ride-data-{timestamp}.csv"
+        temp_path = os.path.join(temp_dir, temp_file)
+
+        logger.info(f"Saving updated data as file {temp_file}")
+        await asyncio.get_running_loop().run_in_executor(None, self.data.to_csv, temp_path)
+        file_loc = await self.async_data_storage.upload_blob(temp_path)
+        os.remove(temp_path)
+
+        return file_loc
     
     # Return dataframe for selected page
     def get_data(self, page):
         return self.data.get(page)
 
+    # Return the mimetype and a generator streaming the hourly data in the time range [start, end)
+    # Input is validated before streaming starts so errors can be returned to the client
+    def export_data(self, start=None, end=None, format='csv'):
+        if format not in export_formats:
+            raise ValueError(f"Unsupported format {format}. Use one of: {', '.join(export_formats)}")
+
+        try:
+            # Times with an offset are converted to the local time of the data
+            start = to_data_time(start) if start else None
+            end = to_data_time(end) if end else None
+        except ValueError:
+            raise ValueError("from and to must be ISO 8601 dates or timestamps")
+        if start is not None and end is not None and start > end:
+            raise ValueError("from must not be after to")
+
+        chunks = self.data.iter_range(start, end)
+        if format == 'csv':
+            rows = self.__export_csv(chunks)
+        elif format == 'ndjson':
+            rows = self.__export_ndjson(chunks)
+        else:
+            rows = self.__export_parquet(chunks)
+
+        return export_formats[format], rows
+
+    # Return the mimetype and an async generator streaming the hourly data in the time range
+    # Each chunk is formatted in a worker thread so the event loop isn't blocked
+    def export_data_async(self, start=None, end=None, format='csv'):
+        mimetype, rows = self.export_data(start, end, format)
+
+        async def stream():
+            loop = asyncio.get_running_loop()
+            finished = object()
+            while True:
+                chunk = await loop.run_in_executor(None, next, rows, finished)
+                if chunk is finished:
+                    break
+                yield chunk.encode() if isinstance(chunk, str) else chunk
+
+        return mimetype, stream()
+
+    def __export_csv(self, chunks):
+        time_format = '%Y-%m-%d %H:%M:%S'
+        yield self.data.data_df.iloc[0:0].to_csv(index=False)
+        for chunk in chunks:
+            yield chunk.to_csv(index=False, header=False, date_format=time_format)
+
+    def __export_ndjson(self, chunks):
+        for chunk in chunks:
+            # Weather values are float32, six decimals keeps them to their stored precision
+            rows = chunk.to_json(orient='records', lines=True, date_format='iso', double_precision=6)
+            yield rows if rows.endswith('\n') else rows + '\n'
+
+    # Write each chunk as a parquet row group and stream it out as soon as it is written
+    def __export_parquet(self, chunks):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        sink = _StreamBuffer()
+        schema = pa.Table.from_pandas(self.data.data_df.iloc[0:0], preserve_index=False).schema
+        writer = pq.ParquetWriter(sink, schema)
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+
     # Get predictions from ML model
     def get_predictions(self, values):
         # run predictions and round to nearest integer and clip any negative numbers to 0
@@ -211,20 +517,44 @@ class BikeShareApi():
         
         return results, predictions
 
+    # Get predictions from ML model in a worker thread
+    async def get_predictions_async(self, values):
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_predictions, values)
+
     # Generate plot image for ride count predictions
-    def create_prediction_plot(self, hours, predictions):
+    # The plot of a cacheable page is named after the page validator etag
+    def create_prediction_plot(self, hours, predictions, etag=None):
+        return self.__create_plot(*self.__get_prediction_plot(hours, predictions), name=etag)
+
+    async def create_prediction_plot_async(self, hours, predictions, etag=None):
+        return await self.__create_plot_async(*self.__get_prediction_plot(hours, predictions), name=etag)
+
+    # Return plot parameters for ride count predictions
+    def __get_prediction_plot(self, hours, predictions):
         title = 'Predicted Ride Count per Hour'
         xlabel = 'Hour'
         ylabel = 'Ride Count'
         xticks =  np.arange(0, 23, 4)
 
-        return self.__create_plot(hours, predictions, title, xlabel, ylabel, xticks)
+        return hours, predictions, title, xlabel, ylabel, xticks
 
     # Generate plot image for data visualizations
-    def create_data_plot(self, request):
+    def create_data_plot(self, request, etag=None):
         # Retrieve selected plot subtype and type 
-        data_type = request.args.get('type')
-        data_subtype = request.args.get('subtype')
+        data_type, data_subtype, plot = self.__get_data_plot(request.args.get('type'),
+                                                             request.args.get('subtype'))
+
+        return data_type, data_subtype, self.__create_plot(*plot, name=etag)
+
+    # Generate plot image for data visualizations. The data is aggregated in a worker thread
+    async def create_data_plot_async(self, request, etag=None):
+        data_type, data_subtype, plot = await asyncio.get_running_loop().run_in_executor(
+                    None, self.__get_data_plot, request.args.get('type'), request.args.get('subtype'))
+
+        return data_type, data_subtype, await self.__create_plot_async(*plot, name=etag)
+
+    # Return the selected type and subtype and the plot parameters for the data visualization
+    def __get_data_plot(self, data_type, data_subtype):
         # error handling if incorrect input was entered
         if data_type is None or data_type not in ['rides', 'weather']:
             data_type = 'rides'
@@ -234,7 +564,7 @@ class BikeShareApi():
         # Handling for the Ride count type plots
         if data_type == 'rides':
             # error handling, set to default of week
-            if data_subtype is None or data_subtype not in ['year', 'week', 'alltime', 'monthly', 'temp', 'wind']:
+            if data_subtype is None or data_subtype not in ['year', 'week', 'alltime', 'monthly', 'temp', 'wind', 'accuracy']:
                 data_subtype = 'week'
             # Get time based parameters
             if data_subtype in ['year', 'week', 'alltime', 'monthly']:
@@ -260,6 +590,16 @@ class BikeShareApi():
                 else:
                     title = 'Ride Count per Hour for Past Week'
                     x = plot_data['Timestamp']
+
+            # Get model accuracy parameters from the backtest
+            elif data_subtype == 'accuracy':
+                by_hour = self.get_backtest()['by_hour']
+                x = np.array([row['hour'] for row in by_hour])
+                y = np.array([row['mae'] for row in by_hour])
+                title = 'Mean Absolute Error of Predicted Ride Count by Hour'
+                xlabel = 'Hour'
+                ylabel = 'Ride Count Error'
+                xticks = np.arange(0, 24, 2)
         
             else:
                 # Get weather based parameters
@@ -309,67 +649,110 @@ class BikeShareApi():
 
         logger.info(f"Creating plot for type: {data_type} and subtype: {data_subtype}")
 
-        return data_type, data_subtype, self.__create_plot(x, y, title, xlabel, ylabel, xticks, plot_type)
+        return data_type, data_subtype, (x, y, title, xlabel, ylabel, xticks, plot_type)
+
+    # Return plot rendering metrics
+    def get_render_metrics(self):
+        return self.renderer.get_metrics()
+
+    # Return the model's error statistics over the full history of the data
+    def get_backtest(self):
+        return self.backtest.get_results()
+
+    # Return the size and memory use of the loaded data
+    def get_data_metrics(self):
+        return {
+            'rows': len(self.data.data_df.index),
+            'bytes_per_row': round(float(self.data.bytes_per_row), 1),
+            'memory': int(self.data.bytes_per_row * len(self.data.data_df.index))
+        }
 
     # Handle image generation for plot creation
-    def __create_plot(self, x, y, title, xlabel, ylabel, xticks, plot_type = 'line'):
-
-        filename = str(uuid.uuid4()) + ".png"
-        temp_path = os.path.join(temp_dir, filename)
-
-        fig, ax = plt.subplots(figsize = ( 8 , 5.5 )) 
-
-        # Create plot of selected type
-        sns.set_style("whitegrid")
-        if plot_type == 'box':
-            sns.boxplot(x=x, y=y)
-        elif plot_type == 'area':
-            sns.lineplot(x=x, y=y)
-            plt.fill_between(x.values, y.values)
-        elif plot_type == 'bar':
-            sns.barplot(x=x, y=y)
-        else:
-            sns.lineplot(x=x, y=y)
-
-        # Set plot display parameters
-        plt.title(title)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        if xlabel == 'Date':
-            # Use date formatting to conform to the timescale of the given data
-            locator = mdates.AutoDateLocator(minticks=4, maxticks=14)
-            ax.xaxis.set_major_locator(locator)
-            ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
-            plt.xlim(min(x), max(x))
-        elif plot_type == 'area':
-            plt.xlim(0, 90)
-        elif plot_type == 'line':
-            plt.xticks(xticks)
-            plt.xlim(min(x) - 1, max(x) + 1)
-        
-        plt.title(title)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.xticks(rotation=45)
-        plt.savefig(temp_path, format='png')
-        plt.close()
+    # Returns None if the plot could not be rendered
+    # A named plot that is already stored, e.g. by another worker, is reused instead of rendered
+    def __create_plot(self, x, y, title, xlabel, ylabel, xticks, plot_type = 'line', name=None):
+        if name is not None:
+            img_url = self.get_stored_plot(name)
+            if img_url is not None:
+                return img_url
+
+        filename = (name or str(uuid.uuid4())) + ".png"
+        # Concurrent requests can render the same named plot, so each renders to its own file
+        temp_path = os.path.join(temp_dir, str(uuid.uuid4()) + ".png")
+
+        # Only the plotted values are sent to the renderer process
+        if xticks is not None:
+            xticks = np.asarray(xticks)
+        try:
+            self.renderer.render(temp_path, np.asarray(x), np.asarray(y),
+                                 title, xlabel, ylabel, xticks, plot_type)
+        except RenderUnavailable as e:
+            logger.warning(f"Plot not rendered: {e}")
+            return None
 
         # Upload image to public storage bucket
         if self.storage_type == 'azure':
-            img_url = self.img_storage.upload_blob(temp_path)
+            img_url = self.img_storage.upload_blob(temp_path, cache_control=plot_cache_control,
+                                                   blob_name=filename)
+            # Another worker stored the same named plot first
+            if img_url is None and name is not None:
+                img_url = self.get_stored_plot(name)
 
         # Default to local path in static directory
         else:
-            static_path = 'images/plots/' + filename
-            local_path = os.path.normpath(os.path.join(os.getcwd(), 'static', static_path))
-            # Ensure the directory exists
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            # Copy the temp file to the static images folder
-            shutil.copyfile(temp_path, local_path)
-            # Generate flask url for the image
-            img_url =  url_for('static', filename=static_path)
+            img_url = self.__copy_to_static(temp_path, filename)
         
         # Cleanup temp file
         os.remove(temp_path)
         return img_url
 
+    # Handle image generation for plot creation without blocking the event loop
+    async def __create_plot_async(self, x, y, title, xlabel, ylabel, xticks, plot_type = 'line', name=None):
+        if name is not None:
+            img_url = await self.get_stored_plot_async(name)
+            if img_url is not None:
+                return img_url
+
+        filename = (name or str(uuid.uuid4())) + ".png"
+        temp_path = os.path.join(temp_dir, str(uuid.uuid4()) + ".png")
+
+        if xticks is not None:
+            xticks = np.asarray(xticks)
+        try:
+            await self.renderer.render_async(temp_path, np.asarray(x), np.asarray(y),
+                                             title, xlabel, ylabel, xticks, plot_type)
+        except RenderUnavailable as e:
+            logger.warning(f"Plot not rendered: {e}")
+            return None
+
+        if self.storage_type == 'azure':
+            img_url = await self.async_img_storage.upload_blob(temp_path, cache_control=plot_cache_control,
+                                                               blob_name=filename)
+            if img_url is None and name is not None:
+                img_url = await self.get_stored_plot_async(name)
+        else:
+            img_url = self.__copy_to_static(temp_path, filename)
+
+        os.remove(temp_path)
+        return img_url
+
+    # Copy the plot image to the static images folder and return its URL
+    def __copy_to_static(self, temp_path, filename):
+        local_path = self.__static_file(filename)
+        # Ensure the directory exists
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        # Copy the temp file to the static images folder. The copy is renamed into place
+        # so a plot being stored by another request is never served part written
+        copy_path = local_path + '.' + str(uuid.uuid4())
+        shutil.copyfile(temp_path, copy_path)
+        os.replace(copy_path, local_path)
+        # Generate url for the image
+        return self.url_for('static', filename=self.__static_name(filename))
+
+    # Return the name of a plot image in the static folder
+    def __static_name(self, filename):
+        return 'images/plots/' + filename
+
+    # Return the local path of a plot image in the static folder
+    def __static_file(self, filename):
+        return os.path.normpath(os.path.join(os.getcwd(), 'static', self.__static_name(filename)))
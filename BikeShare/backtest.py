@@ -0,0 +1,130 @@
+# Backtesting of the prediction model against the recorded hourly ride counts
+# Features for every hour of history are built in one vectorized pass and scored in large batches
+
+from BikeShare.predict import feature_columns
+import pandas as pd
+import numpy as np
+import threading, time
+import logging
+
+logger = logging.getLogger('bike-share-predict')
+
+# Rows scored per model batch
+batch_size = 65536
+
+# Months of each season, matching the one-hot season features of the model
+season_months = {
+    'Fall': [9, 10, 11],
+    'Spring': [3, 4, 5],
+    'Summer': [6, 7, 8],
+    'Winter': [1, 2, 12]
+}
+
+
+# Scores the model over the full history of the ride data
+# Results are cached until the data is edited or a different model is loaded
+class Backtest:
+
+    def __init__(self, data, model):
+        self.data = data
+        self.model = model
+        self.key = None
+        self.results = None
+        # Only one backtest runs at a time, concurrent requests wait for its results
+        self.lock = threading.Lock()
+
+    # Return the backtest results for the current data and model versions
+    def get_results(self):
+        with self.lock:
+            key = (self.data.revision, self.data.version, self.model.version)
+            if self.key != key:
+                self.results = self.run()
+                self.key = key
+
+            return self.results
+
+    # Predict every hour of the data and return the error statistics
+    # Errors are predicted minus actual ride counts so a positive bias means the model over predicts
+    def run(self):
+        started = time.time()
+        data_df = self.data.data_df
+        features = self.get_features(data_df)
+
+        # Round and clip predictions as they are shown to users
+        predictions = self.model.predict(features, batch_size=batch_size)
+        predictions = np.rint(np.asarray(predictions, dtype=np.float64).clip(min=0)).ravel()
+        errors = predictions - data_df['Ride count'].values
+
+        timestamps = pd.DatetimeIndex(data_df['Timestamp'])
+        years = data_df['Year'].values.astype(np.int64)
+        first_year = years.min() if len(years) else 0
+        last_year = years.max() if len(years) else -1
+        elapsed = round(time.time() - started, 3)
+        logger.info(f"Backtested {len(errors)} hours in {elapsed} seconds")
+
+        return {
+            'rows': len(errors),
+            'start': str(timestamps.min()) if len(errors) else None,
+            'end': str(timestamps.max()) if len(errors) else None,
+            'data_revision': self.data.revision,
+            'data_version': self.data.version,
+            'model_version': self.model.version,
+            'elapsed': elapsed,
+            'overall': self.__summarize(errors, np.zeros(len(errors), dtype=np.int64), [0])[0],
+            'by_hour': self.__summarize(errors, data_df['Hour'].values.astype(np.int64),
+                                        range(24), 'hour'),
+            'by_month': self.__summarize(errors, data_df['Month'].values.astype(np.int64) - 1,
+                                         range(1, 13), 'month'),
+            'by_year': self.__summarize(errors, years - first_year,
+                                        range(first_year, last_year + 1), 'year')
+        }
+
+    # Build the model feature array for every row of the data
+    def get_features(self, data_df):
+        from BikeShare.calendar import holiday_flags
+
+        timestamps = pd.DatetimeIndex(data_df['Timestamp'])
+        months = data_df['Month'].values
+        columns = {
+            'Hour': data_df['Hour'].values,
+            'Hi temp': data_df['Hi temp'].values,
+            'Weekend': timestamps.dayofweek > 4,
+            'Year': data_df['Year'].values,
+            'Month': months,
+            'Holiday': holiday_flags(timestamps),
+            'Wind': data_df['Wind'].values,
+            'Rain': data_df['Rain'].values,
+            # Snow is a boolean feature
+            'Snow': data_df['Snow'].values > 0
+        }
+        for season, season_month_list in season_months.items():
+            columns[season] = np.isin(months, season_month_list)
+
+        features = np.empty((len(data_df.index), len(feature_columns)), dtype=np.float32)
+        for index, column in enumerate(feature_columns):
+            features[:, index] = columns[column]
+
+        return features
+
+    # Return the error statistics of each group, labelled with the group values
+    # groups holds the position of each row's group in labels
+    def __summarize(self, errors, groups, labels, name=None):
+        labels = list(labels)
+        counts = np.bincount(groups, minlength=len(labels))
+        sums = np.bincount(groups, weights=errors, minlength=len(labels))
+        absolute = np.bincount(groups, weights=np.abs(errors), minlength=len(labels))
+        squares = np.bincount(groups, weights=errors ** 2, minlength=len(labels))
+
+        summary = []
+        for index, label in enumerate(labels):
+            count = int(counts[index])
+            if count == 0 and name is not None:
+                continue
+            stats = dict() if name is None else {name: int(label)}
+            stats['count'] = count
+            stats['mae'] = round(float(absolute[index] / count), 2) if count else None
+            stats['rmse'] = round(float(np.sqrt(squares[index] / count)), 2) if count else None
+            stats['bias'] = round(float(sums[index] / count), 2) if count else None
+            summary.append(stats)
+
+        return summary
@@ -5,6 +5,7 @@ from pandas.tseries.holiday import AbstractHolidayCalendar, Holiday, \
 
 from pandas import DateOffset
 from dateutil.relativedelta import TH
+import numpy as np
 import datetime as dt
 
 # Create Holiday Calendar
@@ -36,3 +37,17 @@ def get_holidays(year):
     cal = USHolidayCalendar()
 
     return cal.holidays(dt.datetime(year-1, 12, 31), dt.datetime(year, 12, 31))
+
+
+# Return a boolean array flagging the dates or timestamps that fall on a holiday
+# The holidays are generated once for the whole range of years instead of once per date
+def holiday_flags(dates):
+    days = np.asarray(dates, dtype='datetime64[ns]').astype('datetime64[D]')
+    if days.size == 0:
+        return np.zeros(0, dtype=bool)
+
+    years = days.astype('datetime64[Y]').astype(int) + 1970
+    holidays = USHolidayCalendar().holidays(dt.datetime(years.min()-1, 12, 31),
+                                            dt.datetime(years.max(), 12, 31))
+
+    return np.isin(days, holidays.values.astype('datetime64[D]'))
@@ -1,9 +1,49 @@
 import pandas as pd
+import numpy as np
 
-import math
+import datetime as dt
+import hashlib, math, os
+import logging
+
+logger = logging.getLogger('bike-share-predict')
 
 # Set static number of rows to return for queries
 count = 50
+# Number of rows per chunk when streaming exports
+export_count = 5000
+# Decimal places weather values are displayed with
+display_decimals = 2
+# Timestamps of the ride data are naive local times in Washington DC
+data_timezone = 'America/New_York'
+
+# In-memory schema of the hourly data in the layout of the prepared file. Calendar columns
+# are kept as compact integers so a save writes the full layout back. Columns that are not
+# listed, including any saved index column, are not loaded
+column_dtypes = {
+  'Timestamp': 'datetime64[ns]',
+  'Ride count': np.int32,
+  'Hour': np.int8,
+  'Day of week': np.int8,
+  'Month': np.int8,
+  'Day of year': np.int16,
+  'Weekend': np.int8,
+  'Year': np.int16,
+  'Wind': np.float32,
+  'Rain': np.float32,
+  'Snow': np.float32,
+  'Average temp': np.float32,
+  'Hi temp': np.float32,
+  'Lo temp': np.float32,
+  'Holiday': np.int8,
+  'Season': np.int8
+}
+
+# Return the timestamp as a naive local time comparable with the Timestamp column
+def to_data_time(timestamp):
+  timestamp = pd.Timestamp(timestamp)
+  if timestamp.tzinfo is not None:
+    timestamp = timestamp.tz_convert(data_timezone).tz_localize(None)
+  return timestamp
 
 # Class representing Bike Share data object
 class BikeData:
@@ -11,12 +51,19 @@ class BikeData:
   # Initialize the data object
   def __init__(self, summary_file):
 
+      # Weather values are parsed straight to float32. Integer columns are cast after parsing
+      # as files saved by the notebook may store them as floats
+      float_dtypes = {column: dtype for column, dtype in column_dtypes.items() if dtype == np.float32}
       self.data_df = pd.read_csv(
-            filepath_or_buffer=summary_file,  
-            parse_dates=[0])
-      
-      #Ensure that Ride count column is integer
-      self.data_df['Ride count'] = self.data_df['Ride count'].astype(str).astype(int)
+            filepath_or_buffer=summary_file,
+            usecols=lambda column: column in column_dtypes,
+            dtype=float_dtypes,
+            parse_dates=['Timestamp'])
+      self.data_df = self.data_df.astype(column_dtypes)
+
+      # Range queries use a binary search and require the data ordered by time
+      if not self.data_df['Timestamp'].is_monotonic_increasing:
+        self.data_df = self.data_df.sort_values(by=['Timestamp']).reset_index(drop=True)
       # Get number of pages
       self.max_page=math.ceil(len(self.data_df.index)/count)
       # Set data and display columns for updates and output
@@ -30,22 +77,56 @@ class BikeData:
               ]
       self.display_columns = self.data_columns.copy()
       self.display_columns.insert(0, 'Timestamp')
+      self.float_columns = [column for column in self.data_columns if column_dtypes[column] == np.float32]
+
+      # Report the resident memory used per row of data
+      self.bytes_per_row = self.data_df.memory_usage(index=True, deep=True).sum() / max(len(self.data_df.index), 1)
+      logger.info(f"Loaded {len(self.data_df.index)} rows of ride data using {self.bytes_per_row:.1f} bytes per row")
+
+      # Track the data version for HTTP cache validators. The revision is derived from the file
+      # contents so workers that loaded the same file produce the same validators
+      self.version = 0
+      digest = hashlib.md5()
+      with open(summary_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+          digest.update(block)
+      self.revision = digest.hexdigest()
+      self.last_modified = dt.datetime.fromtimestamp(
+            os.path.getmtime(summary_file), dt.timezone.utc).replace(microsecond=0)
 
   # return paginated data
   def get(self, page=1):
       start = count*(page-1)
       end = count*page
-      return self.data_df[self.display_columns].loc[start:end]
+      page_df = self.data_df.loc[start:end, self.display_columns]
+      # Round the float32 values so they display as stored instead of with float32 noise
+      return page_df.astype({column: np.float64 for column in self.float_columns}) \
+                    .round({column: display_decimals for column in self.float_columns})
+
+  # Return the start and end row positions of the time range [start, end)
+  # Located with a binary search on the sorted Timestamp column
+  def find_range(self, start=None, end=None):
+      timestamps = self.data_df['Timestamp'].values
+      first = 0
+      last = len(timestamps)
+      if start is not None:
+        first = int(np.searchsorted(timestamps, to_data_time(start).to_datetime64(), side='left'))
+      if end is not None:
+        last = int(np.searchsorted(timestamps, to_data_time(end).to_datetime64(), side='left'))
+
+      return first, max(first, last)
+
+  # Yield the rows in the time range [start, end) in chunks of at most chunk_rows
+  def iter_range(self, start=None, end=None, chunk_rows=export_count):
+      first, last = self.find_range(start, end)
+      for position in range(first, last, chunk_rows):
+        yield self.data_df.iloc[position:min(position + chunk_rows, last)]
 
   def get_time(self, type):
       # Return 7-day rolling average of ride count over previous year or all time
       if type == 'year' or type == 'alltime':
-        # Copy data and extract the date portion of the time as a new field
-        year_df = self.data_df.copy()
-        year_df['Date'] = year_df['Timestamp'].dt.date
-        
         # Create grouping by Date and total # of rides
-        year_df = year_df.groupby(['Date'], as_index = False)['Ride count'].sum()
+        year_df = self.data_df['Ride count'].groupby(self.get_dates()).sum().reset_index()
         # Calculate 7-day rolling average
         year_df['Rolling avg'] = year_df.iloc[:,1].rolling(window=7).mean()
         if type == 'year':  
@@ -74,19 +155,15 @@ class BikeData:
         return self.data_df.groupby(['Wind'], as_index = False)['Ride count'].mean()
       # return 7-day rolling average of temperature by date
       elif type == 'rolling_temp':
-        temp_df = self.data_df.copy()
-        temp_df['Date'] = temp_df['Timestamp'].dt.date
         # Create grouping by date and average temp
-        temp_df = temp_df.groupby(['Date', 'Average temp'], as_index = False).count()
+        temp_df = self.__by_date('Average temp').groupby(['Date', 'Average temp'], as_index = False).size()
         # Calculate 7-day rolling average
         temp_df['Rolling avg'] = temp_df.iloc[:,1].rolling(window=7).mean()
         return temp_df.tail(365)
       # Return 3-day rolling average of wind speed by date
       elif type == 'rolling_wind':
-        wind_df = self.data_df.copy()
-        wind_df['Date'] = wind_df['Timestamp'].dt.date
         # Create grouping by date and wind speed
-        wind_df = wind_df.groupby(['Date', 'Wind'], as_index = False).count()
+        wind_df = self.__by_date('Wind').groupby(['Date', 'Wind'], as_index = False).size()
         # Calculate 3-day rolling average
         wind_df['Rolling avg'] = wind_df.iloc[:,1].rolling(window=3).mean()
         return wind_df.tail(365)
@@ -94,18 +171,39 @@ class BikeData:
       elif type == 'rain':
         # previous year's data and group by Date
         year = self.data_df['Year'].max()
-        rain_df = self.data_df.loc[self.data_df['Year'] == year]
-        rain_df['Date'] = rain_df['Timestamp'].dt.date
-        rain_df = rain_df.groupby(['Date', 'Rain', 'Month'], as_index = False).count()
+        rain_df = self.__by_date('Rain', 'Month')
+        rain_df = rain_df.loc[self.data_df['Year'].values == year]
+        rain_df = rain_df.groupby(['Date', 'Rain', 'Month'], as_index = False).size()
         # Get Sum of rainfall by month
         rain_df = rain_df.groupby(['Month'], as_index = False)['Rain'].sum()
         return rain_df
 
+  # Return the date of each row as datetime64[D] values
+  def get_dates(self):
+      return pd.Series(self.data_df['Timestamp'].values.astype('datetime64[D]'), name='Date')
+
+  # Return a frame of the selected columns with the date of each row
+  def __by_date(self, *columns):
+      return pd.DataFrame({'Date': self.get_dates(), **{column: self.data_df[column] for column in columns}})
+
   # Update dataframe row matching the selected timestamp
   def update(self, timestamp, updated_values):
-      self.data_df.loc[self.data_df['Timestamp'] == timestamp, self.data_columns] = updated_values.values
+      rows = self.data_df['Timestamp'] == timestamp
+      # Cast the edited values to each column's type so they don't upcast the column
+      for column in self.data_columns:
+        self.data_df.loc[rows, column] = updated_values[column].astype(self.data_df[column].dtype).values
+      # Bump the version and chain the revision with the edit that was applied
+      self.version += 1
+      edit = f"{self.revision}|{timestamp}|{updated_values.values.tolist()}"
+      self.revision = hashlib.md5(edit.encode()).hexdigest()
+      self.last_modified = dt.datetime.now(dt.timezone.utc).replace(microsecond=0)
+
+  # Return an ETag value for a view of the data identified by the supplied parts
+  def etag(self, *parts):
+      key = '|'.join([self.revision, str(self.version)] + [str(part) for part in parts])
+      return hashlib.md5(key.encode()).hexdigest()
 
   # Write dataframe to csv file  
   def to_csv(self, path):
-    self.data_df.to_csv(path)
+    self.data_df.to_csv(path, index=False, date_format='%Y-%m-%d %H:%M:%S')
 
@@ -0,0 +1,284 @@
+# Incremental ingestion of raw Capital Bikeshare trip data into the prepared hourly_rides dataset
+# Raw trip files: https://s3.amazonaws.com/capitalbikeshare-data/index.html
+
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import argparse, glob, json, os
+import logging
+
+from BikeShare.calendar import holiday_flags
+
+logger = logging.getLogger('bike-share-predict')
+
+# Number of trip rows read from a raw file at a time
+chunk_size = 200000
+
+# Trip start column names. Data file format changed after 2020-03
+start_columns = ['Start date', 'started_at']
+
+# Rename NOAA daily summary columns to the names used in the prepared data
+weather_columns = {
+    'AWND': 'Wind',
+    'PRCP': 'Rain',
+    'SNOW': 'Snow',
+    'TAVG': 'Average temp',
+    'TMAX': 'Hi temp',
+    'TMIN': 'Lo temp',
+}
+
+# Column layout of the prepared data as written by the Jupyter notebook
+prepared_columns = [
+    'Timestamp',
+    'Ride count',
+    'Hour',
+    'Day of week',
+    'Month',
+    'Day of year',
+    'Weekend',
+    'Year',
+    'Wind',
+    'Rain',
+    'Snow',
+    'Average temp',
+    'Hi temp',
+    'Lo temp',
+    'Holiday',
+    'Season'
+]
+
+
+# Return the hourly ride counts for a single raw trip file
+# The file is read in chunks so only a single chunk of trips is held in memory
+def count_file_hours(trip_file, chunksize=chunk_size):
+    header = pd.read_csv(trip_file, nrows=0).columns
+    start_column = next((col for col in start_columns if col in header), None)
+    if start_column is None:
+        raise ValueError(f"No trip start column found in {trip_file}")
+
+    partials = []
+    for chunk in pd.read_csv(trip_file, usecols=[start_column], chunksize=chunksize):
+        hours = pd.to_datetime(chunk[start_column]).dt.floor('h')
+        partials.append(hours.value_counts())
+
+    if not partials:
+        return pd.Series(dtype='int64', name='Ride count')
+
+    # Merge partial counts for hours that were split across chunks
+    counts = pd.concat(partials).groupby(level=0).sum()
+    counts.index.name = 'Timestamp'
+    counts.name = 'Ride count'
+    return counts
+
+
+# Return hourly ride counts for all trip files, counting the files in parallel
+def count_hours(trip_files, workers=None, chunksize=chunk_size):
+    if len(trip_files) == 0:
+        return pd.Series(dtype='int64', name='Ride count')
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = list(executor.map(count_file_hours, trip_files,
+                        [chunksize] * len(trip_files)))
+
+    counts = pd.concat(partials).groupby(level=0).sum().sort_index()
+    counts.index.name = 'Timestamp'
+    counts.name = 'Ride count'
+    return counts
+
+
+# Load the daily NOAA weather summary used to enrich the hourly counts
+def load_weather(weather_file):
+    weather_df = pd.read_csv(filepath_or_buffer=weather_file, parse_dates=['DATE'])
+    weather_df.fillna(0, inplace=True)
+    weather_df.rename(mapper=weather_columns, axis=1, inplace=True)
+
+    return weather_df[['DATE'] + list(weather_columns.values())].sort_values(by=['DATE'])
+
+
+# Merge weather into the hourly counts and add the engineered feature columns
+def prepare_hours(counts, weather_df):
+    hourly_df = pd.merge_asof(counts.reset_index(),
+                        weather_df,
+                        left_on='Timestamp',
+                        right_on='DATE',
+                        direction='backward',
+                        tolerance=pd.Timedelta(hours=23))
+
+    # Only match the weather of the same day. Hours past the end of the weather file
+    # would otherwise take the weather of its last day
+    missing = hourly_df['DATE'].isna()
+    if missing.any():
+        raise ValueError(f"No weather for {missing.sum()} hours from "
+                         f"{hourly_df.loc[missing, 'Timestamp'].min()}. Update the weather file")
+
+    timestamps = hourly_df['Timestamp'].dt
+    hourly_df['Hour'] = timestamps.hour
+    hourly_df['Day of week'] = timestamps.dayofweek
+    hourly_df['Month'] = timestamps.month
+    hourly_df['Day of year'] = timestamps.dayofyear
+    # true if day of week is 5 or 6 (saturday or sunday)
+    hourly_df['Weekend'] = (hourly_df['Day of week'] > 4).astype(int)
+    hourly_df['Year'] = timestamps.year
+
+    # Flag every hour falling on a holiday from a single calendar lookup
+    hourly_df['Holiday'] = holiday_flags(hourly_df['Timestamp']).astype(int)
+
+    # Winter 1, Spring 2, Summer 3, Fall 4 based on month
+    seasons = [1, 1, 2, 2, 2, 3, 3, 3, 4, 4, 4, 1]
+    hourly_df['Season'] = hourly_df['Month'].map(dict(zip(range(1, 13), seasons)))
+
+    return hourly_df[prepared_columns]
+
+
+# Load the record of raw files that have already been ingested
+def load_manifest(manifest_file):
+    if not os.path.isfile(manifest_file):
+        return {'files': {}, 'last_timestamp': None}
+
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_file):
+    temp_file = manifest_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_file, manifest_file)
+
+
+# Return the last hour in a prepared file, or None if it has no rows
+def last_prepared_timestamp(output_file):
+    timestamps = pd.read_csv(output_file, usecols=['Timestamp'], parse_dates=['Timestamp'])['Timestamp']
+    return None if timestamps.empty else timestamps.max()
+
+
+# Finish or undo an ingest that stopped between writing the prepared file and the manifest
+# Appended hours are truncated so they are ingested again. A rewrite that completed is recorded.
+def recover_manifest(manifest, manifest_file, output_file):
+    pending = manifest.pop('pending', None)
+    if pending is None:
+        return manifest
+
+    temp_file = output_file + '.tmp'
+    if 'append' in pending:
+        logger.warning("Previous ingest did not complete. Removing its appended hours")
+        with open(output_file, 'r+b') as f:
+            f.truncate(pending['append'])
+    elif os.path.isfile(temp_file):
+        logger.warning("Previous ingest did not complete. Discarding its rewritten data")
+        os.remove(temp_file)
+    else:
+        manifest = pending['manifest']
+
+    save_manifest(manifest, manifest_file)
+    return manifest
+
+
+# Ingest any trip files not yet recorded in the manifest into the prepared data file
+# New hours are appended to the prepared file. If new trips fall into hours already written
+# the prepared file is rewritten with the combined counts.
+# A prepared file without a manifest, such as one written by the notebook, is taken to hold every
+# hour up to its last timestamp. Set rebuild to replace it with the supplied trip files instead.
+def ingest(trip_files, weather_file, output_file, manifest_file=None,
+           workers=None, chunksize=chunk_size, rebuild=False):
+    if manifest_file is None:
+        manifest_file = os.path.splitext(output_file)[0] + '.manifest.json'
+
+    adopted = None
+    if rebuild or not os.path.isfile(output_file):
+        # Build the prepared file from every supplied trip file
+        manifest = {'files': {}, 'last_timestamp': None}
+    elif not os.path.isfile(manifest_file):
+        adopted = last_prepared_timestamp(output_file)
+        manifest = {'files': {}, 'last_timestamp': None if adopted is None else adopted.isoformat()}
+        logger.info(f"No manifest for {output_file}. Treating hours up to {adopted} as already ingested")
+    else:
+        manifest = recover_manifest(load_manifest(manifest_file), manifest_file, output_file)
+
+    new_files = [file for file in sorted(trip_files)
+                 if os.path.basename(file) not in manifest['files']]
+    if not new_files:
+        logger.info("No new trip files to ingest")
+        return 0
+
+    logger.info(f"Ingesting {len(new_files)} new trip files")
+    counts = count_hours(new_files, workers=workers, chunksize=chunksize)
+    if adopted is not None:
+        skipped = counts.index <= adopted
+        if skipped.any():
+            logger.warning(f"Skipping {skipped.sum()} hours already in {output_file}")
+            counts = counts.loc[~skipped]
+    if counts.empty:
+        logger.warning("New trip files did not contain any trips")
+        hourly_df = None
+    else:
+        hourly_df = prepare_hours(counts, load_weather(weather_file))
+
+    # Manifest recorded once the prepared file is written
+    last_timestamp = manifest['last_timestamp']
+    files = dict(manifest['files'])
+    for file in new_files:
+        files[os.path.basename(file)] = {
+            'size': os.path.getsize(file),
+            'ingested': pd.Timestamp.now().isoformat(timespec='seconds')
+        }
+    ingested = {'files': files, 'last_timestamp': last_timestamp}
+    if not counts.empty:
+        latest = counts.index.max()
+        if last_timestamp is not None:
+            latest = max(latest, pd.Timestamp(last_timestamp))
+        ingested['last_timestamp'] = latest.isoformat()
+
+    # The manifest is marked pending while the prepared file is written
+    # so a run that stops part way is finished or undone by the next run
+    temp_file = output_file + '.tmp'
+    # Keep the column order of the existing prepared file. Files saved with an index
+    # column are rewritten without it as appended rows would not line up
+    columns = None if last_timestamp is None else list(pd.read_csv(output_file, nrows=0).columns)
+    if hourly_df is None:
+        pass
+    elif last_timestamp is not None and hourly_df['Timestamp'].min() > pd.Timestamp(last_timestamp) \
+            and all(column in prepared_columns for column in columns):
+        manifest['pending'] = {'append': os.path.getsize(output_file)}
+        save_manifest(manifest, manifest_file)
+        hourly_df[columns].to_csv(output_file, mode='a', header=False, index=False)
+    else:
+        if last_timestamp is None:
+            hourly_df.to_csv(temp_file, index=False)
+        else:
+            logger.info("Rewriting prepared data with the new hours")
+            existing_df = pd.read_csv(output_file, usecols=lambda column: column in prepared_columns,
+                                      parse_dates=['Timestamp'])
+            # Add the new trips to hours that were already written
+            overlap = existing_df['Timestamp'].isin(counts.index)
+            existing_df.loc[overlap, 'Ride count'] += counts.reindex(
+                        existing_df.loc[overlap, 'Timestamp']).values
+            hourly_df = hourly_df.loc[~hourly_df['Timestamp'].isin(existing_df['Timestamp'])]
+            existing_df = pd.concat([existing_df, hourly_df[existing_df.columns]])
+            existing_df.sort_values(by=['Timestamp']).to_csv(temp_file, index=False)
+
+        manifest['pending'] = {'replace': True, 'manifest': ingested}
+        save_manifest(manifest, manifest_file)
+        os.replace(temp_file, output_file)
+
+    save_manifest(ingested, manifest_file)
+
+    added = 0 if hourly_df is None else len(hourly_df.index)
+    logger.info(f"Ingested {added} hours into {output_file}")
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build hourly_rides.csv from raw trip data files')
+    parser.add_argument('raw_dir', help='Directory containing the raw *-capitalbikeshare-tripdata.csv files')
+    parser.add_argument('weather_file', help='NOAA daily summary csv covering the trip dates')
+    parser.add_argument('output_file', help='Prepared hourly data file loaded by the application')
+    parser.add_argument('--workers', type=int, default=None, help='Number of ingestion processes')
+    parser.add_argument('--chunksize', type=int, default=chunk_size, help='Trip rows read per chunk')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Replace the prepared file with the hours of the raw trip files')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    trip_files = glob.glob(os.path.join(args.raw_dir, '*-capitalbikeshare-tripdata.csv'))
+    ingest(trip_files, args.weather_file, args.output_file,
+           workers=args.workers, chunksize=args.chunksize, rebuild=args.rebuild)
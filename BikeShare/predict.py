@@ -1,15 +1,41 @@
-from tensorflow.keras.models import load_model
+import os, threading
+
+# Model feature columns in the order the model was trained with
+feature_columns = ['Hour', 'Hi temp', 'Weekend', 'Year', 'Month', 'Fall', 'Spring',
+                   'Summer', 'Winter', 'Holiday', 'Wind', 'Rain', 'Snow']
 
 # Class representing a tensorflow ml model
+# Tensorflow is imported and the model loaded on the first prediction to keep application start fast
 class BikeShareModel:
-  # Initialize the data model by importing from file
+  # Initialize the data model with the path to the saved model
   def __init__(self, model_file):
-    self.model = load_model(model_file)
+    self.model_file = model_file
+    self.model = None
+    self.lock = threading.Lock()
+    # Identify the saved model by the latest modification time of its files
+    # so results computed from an older model can be recognised
+    self.version = self.__get_version()
+
+  # Load the model from file if it hasn't been loaded yet
+  def load(self):
+    with self.lock:
+      if self.model is None:
+        from tensorflow.keras.models import load_model
+        self.model = load_model(self.model_file)
+
+    return self.model
 
   # Return predictions based on input data
-  def predict(self, data):
+  # Large inputs should pass a batch_size so they are scored in a few large batches
+  def predict(self, data, batch_size=None):
+
+    return self.load().predict(data, batch_size=batch_size)
 
-    return self.model.predict(data)
+  # Return the latest modification time of the saved model files or 0 if not found
+  def __get_version(self):
+    version = 0
+    for root, dirs, files in os.walk(self.model_file):
+      for name in files:
+        version = max(version, int(os.path.getmtime(os.path.join(root, name))))
 
-    
-  
\ No newline at end of file
+    return version
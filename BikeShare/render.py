@@ -0,0 +1,331 @@
+# Plot rendering in a dedicated pool of worker processes
+# Workers import matplotlib once at startup and only receive the small aggregated arrays to plot
+
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+import asyncio, functools, multiprocessing, os, threading, time
+import logging
+
+logger = logging.getLogger('bike-share-predict')
+
+# Seconds a render waits for new worker processes to start before its timeout begins
+start_timeout = 60
+
+# Modules imported once by the forkserver so recreated workers don't each import them
+forkserver_preload = ['matplotlib', 'matplotlib.pyplot', 'matplotlib.dates', 'seaborn', 'BikeShare.render']
+
+# Plotting modules, imported in each worker process by init_worker
+plt = None
+mdates = None
+sns = None
+
+
+# Raised when a plot can't be rendered because the renderer is saturated, timed out or failed
+class RenderUnavailable(Exception):
+    pass
+
+
+# Import the plotting libraries once when a worker process starts
+def init_worker():
+    global plt, mdates, sns
+    import matplotlib
+    # Setting matplotlib backend to prevent conflict with Flask
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import matplotlib.dates
+    import seaborn
+
+    plt = matplotlib.pyplot
+    mdates = matplotlib.dates
+    sns = seaborn
+    sns.set_style("whitegrid")
+
+
+# No-op task used to start the worker processes
+def ready():
+    return os.getpid()
+
+
+# Render the plot to a png file at path. Runs in a worker process
+# Returns the times rendering started and finished
+def render_plot(path, x, y, title, xlabel, ylabel, xticks, plot_type='line'):
+    started = time.time()
+    if plt is None:
+        init_worker()
+
+    fig, ax = plt.subplots(figsize = ( 8 , 5.5 ))
+
+    # Create plot of selected type
+    if plot_type == 'box':
+        sns.boxplot(x=x, y=y)
+    elif plot_type == 'area':
+        sns.lineplot(x=x, y=y)
+        plt.fill_between(x, y)
+    elif plot_type == 'bar':
+        sns.barplot(x=x, y=y)
+    else:
+        sns.lineplot(x=x, y=y)
+
+    # Set plot display parameters
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    if xlabel == 'Date':
+        # Use date formatting to conform to the timescale of the given data
+        locator = mdates.AutoDateLocator(minticks=4, maxticks=14)
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        plt.xlim(min(x), max(x))
+    elif plot_type == 'area':
+        plt.xlim(0, 90)
+    elif plot_type == 'line':
+        plt.xticks(xticks)
+        plt.xlim(min(x) - 1, max(x) + 1)
+
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.xticks(rotation=45)
+    plt.savefig(path, format='png')
+    plt.close()
+
+    return started, time.time()
+
+
+# Remove the output of a render whose result was abandoned
+def _remove_output(path):
+    def remove(future):
+        if os.path.exists(path):
+            os.remove(path)
+    return remove
+
+
+# Shut down a replaced pool once its management thread has stopped, without blocking the caller
+# Closing the pool while the thread is still running fails on Python 3.8
+def _shutdown(executor):
+    threading.Thread(target=executor.shutdown, daemon=True).start()
+
+
+# Pool of plot rendering processes with a per-render timeout and bounded queue
+class PlotRenderer:
+
+    def __init__(self, workers=2, timeout=10.0, queue_depth=8):
+        # Daemonic processes, like hypercorn workers when running more than one, can't have child
+        # processes. Plots are then rendered in the server process one at a time as pyplot isn't
+        # thread safe
+        self.inline = multiprocessing.current_process().daemon
+        self.workers = 1 if self.inline else workers
+        self.timeout = timeout
+        self.queue_depth = queue_depth
+
+        self.lock = threading.Lock()
+        # Held while a plot is rendered in the server process
+        self.render_lock = threading.Lock()
+        # Pool each queued or running render was submitted to
+        self.pending = dict()
+        # Number of renders waiting for or holding the render lock
+        self.waiting = 0
+        self.metrics = dict(rendered=0, rejected=0, timeouts=0, failures=0,
+                            render_time=0.0, max_render_time=0.0,
+                            queue_wait=0.0, max_queue_wait=0.0)
+        self.executor = None if self.inline else self.__create_executor()
+        # Tasks that complete once the workers of the current pool have started
+        self.starting = []
+
+    # Start the worker processes. Workers are forked so this should run before
+    # large libraries like tensorflow are loaded into the parent process.
+    # Doesn't wait for the workers to import the plotting libraries
+    def start(self):
+        if self.inline:
+            logger.warning("Plot rendering processes can't be started from a daemonic process. "
+                           "Plots are rendered one at a time in the server process without a render timeout")
+            return
+
+        with self.lock:
+            self.starting = self.__start_workers()
+        logger.info(f"Started {self.workers} plot rendering processes")
+
+    # Render a plot to the png file at path
+    # Raises RenderUnavailable if the queue is full or the render fails or times out
+    # The timeout begins once the pool's workers have started
+    def render(self, path, x, y, title, xlabel, ylabel, xticks, plot_type='line'):
+        if self.inline:
+            return self.__render_inline(path, x, y, title, xlabel, ylabel, xticks, plot_type)
+
+        executor, future, starting, submitted = self.__submit(path, x, y, title, xlabel, ylabel, xticks, plot_type)
+        try:
+            wait(starting, timeout=start_timeout)
+            started, finished = future.result(timeout=self.timeout)
+        except TimeoutError:
+            self.__abandon(executor, future, path)
+        except Exception as e:
+            self.__failed(executor, e)
+
+        self.__record(submitted, started, finished)
+
+    # Render a plot without blocking the event loop
+    async def render_async(self, path, x, y, title, xlabel, ylabel, xticks, plot_type='line'):
+        if self.inline:
+            return await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                self.__render_inline, path, x, y, title, xlabel, ylabel, xticks, plot_type))
+
+        executor, future, starting, submitted = self.__submit(path, x, y, title, xlabel, ylabel, xticks, plot_type)
+        try:
+            if not all(task.done() for task in starting):
+                await asyncio.wait([asyncio.wrap_future(task) for task in starting], timeout=start_timeout)
+            started, finished = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.__abandon(executor, future, path)
+        except Exception as e:
+            self.__failed(executor, e)
+
+        self.__record(submitted, started, finished)
+
+    # Queue a render in the pool unless the queue is full
+    def __submit(self, path, x, y, title, xlabel, ylabel, xticks, plot_type):
+        submitted = time.time()
+        with self.lock:
+            if len(self.pending) >= self.workers + self.queue_depth:
+                self.metrics['rejected'] += 1
+                raise RenderUnavailable("Plot renderer queue is full")
+
+            executor = self.executor
+            starting = self.starting
+            try:
+                future = executor.submit(render_plot, path, x, y, title,
+                                         xlabel, ylabel, xticks, plot_type)
+                self.pending[future] = executor
+            except BrokenProcessPool:
+                future = None
+
+        if future is None:
+            self.__restart(executor)
+            raise RenderUnavailable("Plot renderer processes failed")
+        future.add_done_callback(self.__release)
+
+        return executor, future, starting, submitted
+
+    # Render a plot in the server process once the renders ahead of it have finished
+    # A render can't be interrupted so only the wait for the renders ahead of it times out
+    def __render_inline(self, path, x, y, title, xlabel, ylabel, xticks, plot_type):
+        submitted = time.time()
+        with self.lock:
+            if self.waiting >= self.workers + self.queue_depth:
+                self.metrics['rejected'] += 1
+                raise RenderUnavailable("Plot renderer queue is full")
+            self.waiting += 1
+
+        try:
+            if not self.render_lock.acquire(timeout=self.timeout):
+                with self.lock:
+                    self.metrics['timeouts'] += 1
+                raise RenderUnavailable(f"Plot renderer was busy for more than {self.timeout} seconds")
+            try:
+                started, finished = render_plot(path, x, y, title, xlabel, ylabel, xticks, plot_type)
+            except Exception as e:
+                self.__failed(None, e)
+            finally:
+                self.render_lock.release()
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+        self.__record(submitted, started, finished)
+
+    # Give up on a render that timed out
+    # A running render can't be interrupted so the pool is replaced to free its worker
+    # The render fails with the pool rather than being cancelled, as the pool fails it
+    # when its workers are terminated
+    def __abandon(self, executor, future, path):
+        future.add_done_callback(_remove_output(path))
+        with self.lock:
+            self.metrics['timeouts'] += 1
+        self.__recycle(executor)
+        raise RenderUnavailable(f"Plot render exceeded {self.timeout} seconds")
+
+    def __failed(self, executor, error):
+        if isinstance(error, BrokenProcessPool):
+            self.__restart(executor)
+            raise RenderUnavailable("Plot renderer processes failed")
+
+        logger.error(error)
+        with self.lock:
+            self.metrics['failures'] += 1
+        raise RenderUnavailable("Plot render failed")
+
+    def __record(self, submitted, started, finished):
+        render_time = finished - started
+        queue_wait = max(started - submitted, 0.0)
+        with self.lock:
+            self.metrics['rendered'] += 1
+            self.metrics['render_time'] += render_time
+            self.metrics['max_render_time'] = max(self.metrics['max_render_time'], render_time)
+            self.metrics['queue_wait'] += queue_wait
+            self.metrics['max_queue_wait'] = max(self.metrics['max_queue_wait'], queue_wait)
+
+    # Return render counts and timings in seconds
+    def get_metrics(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+            metrics['pending'] = len(self.pending) + self.waiting
+
+        rendered = metrics['rendered']
+        metrics['avg_render_time'] = metrics['render_time'] / rendered if rendered else 0.0
+        metrics['avg_queue_wait'] = metrics['queue_wait'] / rendered if rendered else 0.0
+        metrics.update(workers=self.workers, timeout=self.timeout, queue_depth=self.queue_depth)
+        return metrics
+
+    # Pools created after start() use a forkserver. Forking the parent then would copy
+    # tensorflow and the server threads into the workers
+    def __create_executor(self, restart=False):
+        methods = multiprocessing.get_all_start_methods()
+        if restart and 'forkserver' in methods:
+            context = multiprocessing.get_context('forkserver')
+            # The server imports the plotting libraries but not the application module
+            context.set_forkserver_preload(forkserver_preload)
+        # Fork where available so workers don't re-import the application module
+        elif 'fork' in methods:
+            context = multiprocessing.get_context('fork')
+        else:
+            context = None
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                   initializer=init_worker)
+
+    # Replace a pool whose worker processes died
+    def __restart(self, executor):
+        with self.lock:
+            self.metrics['failures'] += 1
+            if self.executor is executor:
+                logger.warning("Plot renderer processes failed. Restarting renderer pool")
+                self.__replace()
+                _shutdown(executor)
+
+    # Replace a pool with a stuck render, terminating its worker processes
+    # The pool then fails the other renders queued or running in it
+    def __recycle(self, executor):
+        with self.lock:
+            if self.executor is not executor:
+                return
+            logger.warning("Plot render timed out. Replacing renderer pool")
+            processes = list((executor._processes or {}).values())
+            self.__replace()
+            # Free the slots of the abandoned renders now instead of when they finish
+            for future in [future for future, owner in self.pending.items() if owner is executor]:
+                del self.pending[future]
+
+        for process in processes:
+            process.terminate()
+        _shutdown(executor)
+
+    # Start a new pool in place of the current one. Called with the lock held
+    def __replace(self):
+        self.executor = self.__create_executor(restart=True)
+        self.starting = self.__start_workers()
+
+    # Submit a no-op task for each worker so every worker process is started
+    def __start_workers(self):
+        return [self.executor.submit(ready) for _ in range(self.workers)]
+
+    def __release(self, future):
+        with self.lock:
+            self.pending.pop(future, None)
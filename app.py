@@ -1,118 +1,178 @@
 # Requires Python 3.8
-from flask import Flask, request, render_template, redirect
-import logging
+from flask import Flask, Response, request, render_template, redirect, make_response, \
+    stream_with_context
 
 from app_config import initialize
+from http_cache import is_not_modified, set_cache_headers, static_page_max_age, plot_cache_control
+import pages
 
-# Configure Default Logger
-root_logger = logging.getLogger()
-root_logger.setLevel(logging.WARNING)
-
-# Configure App Logger
-logger = logging.getLogger('bike-share-predict')
-logger.setLevel(logging.INFO)
-ch = logging.StreamHandler()
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', "%Y-%m-%d %H:%M:%S")
-ch.setFormatter(formatter)
-logger.addHandler(ch)
+pages.configure_logging()
 
 app = Flask(__name__, instance_relative_config=True)
-service = initialize()
+# Plot renderer processes started with forkserver import this module as __mp_main__
+# when it's run as a script. Only the server process starts the service
+if __name__ != '__mp_main__':
+    service = initialize()
+    # Cached pages embedding a plot are also revalidated against their templates
+    service.page_version = pages.plot_page_version(app)
+
+predict_etag = pages.predict_etag(app)
+
+# Return a 304 response if the client's cached copy matches the supplied validators
+def not_modified(etag, last_modified=None):
+    if etag is None or not is_not_modified(request, etag, last_modified):
+        return None
+
+    return set_cache_headers(make_response('', 304), etag, last_modified)
+
+# Return a 304 response if the client's cached copy of a page embedding a plot matches the
+# supplied validators and its plot is still stored
+def plot_not_modified(etag, last_modified):
+    response = not_modified(etag, last_modified)
+    if response is None or service.get_stored_plot(etag) is None:
+        return None
+
+    return response
+
+# Rendered plot images are never modified after creation
+@app.after_request
+def cache_plot_images(response):
+    if request.path.startswith('/static/images/plots/') and response.status_code == 200:
+        response.headers['Cache-Control'] = plot_cache_control
+
+    return response
 
 # Main page handling
 @app.route('/', methods=['GET', 'POST'])
 def index():
+    etag = None
     if request.method == 'POST':
         # Get values from user submitted fields
         values = service.get_predict_form_values(request.form)
-        message = f"Estimated Ride counts for {request.form['date']}"
+        message = pages.form_message(request.form)
     else:
+        # The page only changes when a new forecast is retrieved
+        response = plot_not_modified(*service.get_forecast_validators())
+        if response is not None:
+            return response
+
         # Generate values for tomorrow
         values = service.get_predict_values()
-        message = "Tomorrow's Estimated Ride counts"
-    
+        message = pages.tomorrow_message
+        etag, last_modified = service.get_forecast_validators()
+
     results, predictions = service.get_predictions(values)
-        
+
     # Graph the results and create image
-    img_url = service.create_prediction_plot(values['Hour'], predictions)
-        
+    img_url = service.create_prediction_plot(values['Hour'], predictions, etag)
+
     # Render prediction results html page
-    return render_template('main.html',
-                                message = message,
-                                results = results,
-                                sum = predictions.sum(),
-                                img_url= img_url), 200
+    response = make_response(render_template('main.html',
+                                **pages.prediction_args(message, results, predictions, img_url)), 200)
+    # Don't let clients cache a page missing its plot
+    if etag is not None and img_url is not None:
+        set_cache_headers(response, etag, last_modified)
+
+    return response
 
 @app.route('/predict', methods=['GET'])
 def predict():
+    response = not_modified(predict_etag)
+    if response is not None:
+        return response
 
-    return render_template('predict.html'), 200
+    return set_cache_headers(make_response(render_template('predict.html'), 200),
+                             predict_etag, max_age=static_page_max_age)
 
 
 @app.route('/data', methods=['GET', 'POST'])
 def data_page():
-    # Get page number if supplied
-    page = request.args.get('page')
-    max_page = service.data.max_page
-    if page is None:
-        page = 1
-    else:
-        try: 
-            page = int(page)
-            if page > max_page:
-                return redirect(f"/data?page={max_page}")
-            elif page < 1:
-                return redirect(f"/data?page=1")
-        except ValueError:
-            return redirect(f"/data?page=1")
+    page, redirect_url = pages.get_page(request.args, service.data.max_page)
+    if redirect_url is not None:
+        return redirect(redirect_url)
 
     # set default message to null
     message = ''
     if request.args.get('save'):
-        url = service.save_data_values()
-        message = f"Data saved to {url}"
+        message = pages.save_message(service.save_data_values())
 
-    # Handle data update from edit        
+    # Handle data update from edit
     if request.method == 'POST':
-        timestamp = request.args.get('timestamp')
+        service.update_data_values(request.form, request.args.get('timestamp'))
 
-        service.update_data_values(request.form, timestamp)
+        return redirect(pages.data_page_url(page))
 
-        return redirect(f"/data?page={page}")
+    edit = pages.get_edit(request.args)
+    etag, last_modified = pages.data_validators(service, request.args, page, edit)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
 
-    # check if edit param was set to true
-    edit_flag = request.args.get('edit')
-    if edit_flag is None:
-        edit = False
-    elif edit_flag.lower() == "true": 
-        edit = True
-    else:
-        edit = False
+    response = make_response(render_template('data.html',
+                                    **pages.data_args(service, page, edit, message)))
+    if etag is not None:
+        set_cache_headers(response, etag, last_modified)
 
-
-    values = service.get_data(page=page)
-    # convert to list of dict
-    values = values.to_dict(orient='records')
-
-    return render_template('data.html',
-                                    columns = service.data.display_columns,
-                                    values = values,
-                                    edit = edit,
-                                    page = page,
-                                    max_page = max_page,
-                                    message = message)
+    return response
 
 
 
 @app.route('/visuals', methods=['GET'])
 def visuals():
+    etag, last_modified = pages.visuals_validators(service, request.args)
+    response = plot_not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    selected, subtype, img_url = service.create_data_plot(request, etag)
+
+    response = make_response(render_template('visual.html',
+                    **pages.visual_args(selected, subtype, img_url)))
+    # Don't let clients cache a page missing its plot
+    if img_url is None:
+        return response
+
+    return set_cache_headers(response, etag, last_modified)
+
+
+# Stream hourly data for a time range as csv, ndjson or parquet
+@app.route('/api/data', methods=['GET'])
+def export_data():
+    format, export_args = pages.export_args(request.args)
+    try:
+        mimetype, rows = service.export_data(**export_args)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    return Response(stream_with_context(rows), mimetype=mimetype, headers=pages.export_headers(format))
+
+
+# Predict daily totals for a grid of weather scenarios on a date
+@app.route('/api/scenarios', methods=['GET'])
+def scenarios():
+    try:
+        grid = service.get_scenario_grid(**pages.scenario_args(request.args))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    return grid
+
+
+# Return the model's error statistics over the full history of the data
+@app.route('/api/backtest', methods=['GET'])
+def backtest():
+    etag, last_modified = pages.backtest_validators(service)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    return set_cache_headers(make_response(service.get_backtest()), etag, last_modified)
 
-    selected, subtype, img_url = service.create_data_plot(request)
 
-    return render_template('visual.html',
-                    img_url = img_url,
-                    type = selected,
-                    subtype = subtype)
+# Return plot rendering counts and timings and the memory use of the data
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return pages.get_metrics(service)
 
 
 # Start the application
@@ -1,4 +1,4 @@
-import os
+import os, tempfile
 from BikeShare.api import BikeShareApi
 import logging
 
@@ -8,6 +8,14 @@ logger = logging.getLogger('bike-share-predict')
 model_path = os.path.abspath(os.path.join(os.getcwd(),'models/bike_share' ))
 data_filename = 'hourly_rides.csv'
 
+# Plot rendering process pool defaults
+default_render_workers = 2
+default_render_timeout = 10.0
+default_render_queue_depth = 8
+
+# Downloaded blobs are cached here unless BLOB_CACHE_DIR is set
+default_blob_cache_dir = os.path.join(tempfile.gettempdir(), 'bike-share-blob-cache')
+
 
 def initialize():
     # Fetch Environment variables for configuration
@@ -15,15 +23,29 @@ def initialize():
     if not weather_api_key:
         raise ValueError("Need to define WEATHER_API_KEY")
 
-    storage_url= os.getenv('AZURE_STORAGE_ACCOUNT_URL')
+    # Optional plot renderer settings
+    render_options = dict(
+        render_workers=int(os.getenv('PLOT_RENDER_WORKERS', default_render_workers)),
+        render_timeout=float(os.getenv('PLOT_RENDER_TIMEOUT', default_render_timeout)),
+        render_queue_depth=int(os.getenv('PLOT_RENDER_QUEUE_DEPTH', default_render_queue_depth))
+    )
+
+    # Optional stand-in for the weather API, e.g. for load testing
+    weather_api_url = os.getenv('WEATHER_API_URL') or None
+
+    storage_url= os.getenv('AZURE_STORAGE_ACCOUNT_URL') or None
+    # A connection string can be used instead of the account URL and managed identity
+    storage_connection_string = os.getenv('AZURE_STORAGE_CONNECTION_STRING') or None
     # if Storage URL var isn't set, default to local storage
-    if not storage_url:
+    if not storage_url and not storage_connection_string:
         logger.info('Env variable AZURE_STORAGE_ACCOUNT_URL not set. Using local storage')
         data_file = os.path.join(os.getcwd(), 'data/prepared', data_filename)
 
         api = BikeShareApi(data_file=data_file,
               model_path=model_path,
-              weather_api_key=weather_api_key)
+              weather_api_key=weather_api_key,
+              weather_api_url=weather_api_url,
+              **render_options)
 
     # Get config parameters for Azure Storage
     else:
@@ -39,8 +61,12 @@ def initialize():
               model_path=model_path,
               weather_api_key=weather_api_key, 
               storage_url=storage_url, 
+              storage_connection_string=storage_connection_string,
+              weather_api_url=weather_api_url,
               data_container_name=data_container_name,
-              img_container_name=img_container_name
+              img_container_name=img_container_name,
+              blob_cache_dir=os.getenv('BLOB_CACHE_DIR', default_blob_cache_dir),
+              **render_options
               )
     
     return api
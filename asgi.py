@@ -0,0 +1,199 @@
+# Requires Python 3.8
+# ASGI version of the application for serving with asyncio, e.g. `hypercorn asgi:app`
+# Weather requests and blob uploads are awaited and the CPU bound predictions
+# and plots run in executors, so one process can serve many concurrent requests
+from quart import Quart, Response, request, render_template, redirect, make_response, url_for, jsonify
+import asyncio, functools
+
+from app_config import initialize
+from http_cache import is_not_modified, set_cache_headers, static_page_max_age, plot_cache_control
+import pages
+
+pages.configure_logging()
+
+app = Quart(__name__)
+# Plot renderer processes started with forkserver import this module as __mp_main__
+# when it's run as a script. Only the server process starts the service
+if __name__ != '__mp_main__':
+    service = initialize()
+    # Cached pages embedding a plot are also revalidated against their templates
+    service.page_version = pages.plot_page_version(app)
+
+predict_etag = pages.predict_etag(app)
+
+# Create the async clients once the event loop is running
+@app.before_serving
+async def start_service():
+    service.url_for = url_for
+    await service.start_async()
+
+@app.after_serving
+async def stop_service():
+    await service.close_async()
+
+# Return a 304 response if the client's cached copy matches the supplied validators
+async def not_modified(etag, last_modified=None):
+    if etag is None or not is_not_modified(request, etag, last_modified):
+        return None
+
+    return set_cache_headers(await make_response('', 304), etag, last_modified)
+
+# Return a 304 response if the client's cached copy of a page embedding a plot matches the
+# supplied validators and its plot is still stored
+async def plot_not_modified(etag, last_modified):
+    response = await not_modified(etag, last_modified)
+    if response is None or await service.get_stored_plot_async(etag) is None:
+        return None
+
+    return response
+
+# Run a blocking service call in the default executor
+async def run_blocking(function, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+# Rendered plot images are never modified after creation
+@app.after_request
+async def cache_plot_images(response):
+    if request.path.startswith('/static/images/plots/') and response.status_code == 200:
+        response.headers['Cache-Control'] = plot_cache_control
+
+    return response
+
+# Main page handling
+@app.route('/', methods=['GET', 'POST'])
+async def index():
+    etag = None
+    if request.method == 'POST':
+        # Get values from user submitted fields
+        form = await request.form
+        values = service.get_predict_form_values(form)
+        message = pages.form_message(form)
+    else:
+        # The page only changes when a new forecast is retrieved
+        response = await plot_not_modified(*service.get_forecast_validators())
+        if response is not None:
+            return response
+
+        # Generate values for tomorrow
+        values = await service.get_predict_values_async()
+        message = pages.tomorrow_message
+        etag, last_modified = service.get_forecast_validators()
+
+    results, predictions = await service.get_predictions_async(values)
+
+    # Graph the results and create image
+    img_url = await service.create_prediction_plot_async(values['Hour'], predictions, etag)
+
+    # Render prediction results html page
+    response = await make_response(await render_template('main.html',
+                                **pages.prediction_args(message, results, predictions, img_url)), 200)
+    # Don't let clients cache a page missing its plot
+    if etag is not None and img_url is not None:
+        set_cache_headers(response, etag, last_modified)
+
+    return response
+
+@app.route('/predict', methods=['GET'])
+async def predict():
+    response = await not_modified(predict_etag)
+    if response is not None:
+        return response
+
+    return set_cache_headers(await make_response(await render_template('predict.html'), 200),
+                             predict_etag, max_age=static_page_max_age)
+
+
+@app.route('/data', methods=['GET', 'POST'])
+async def data_page():
+    page, redirect_url = pages.get_page(request.args, service.data.max_page)
+    if redirect_url is not None:
+        return redirect(redirect_url)
+
+    # set default message to null
+    message = ''
+    if request.args.get('save'):
+        message = pages.save_message(await service.save_data_values_async())
+
+    # Handle data update from edit
+    if request.method == 'POST':
+        service.update_data_values(await request.form, request.args.get('timestamp'))
+
+        return redirect(pages.data_page_url(page))
+
+    edit = pages.get_edit(request.args)
+    etag, last_modified = pages.data_validators(service, request.args, page, edit)
+    response = await not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    response = await make_response(await render_template('data.html',
+                                    **pages.data_args(service, page, edit, message)))
+    if etag is not None:
+        set_cache_headers(response, etag, last_modified)
+
+    return response
+
+
+@app.route('/visuals', methods=['GET'])
+async def visuals():
+    etag, last_modified = pages.visuals_validators(service, request.args)
+    response = await plot_not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    selected, subtype, img_url = await service.create_data_plot_async(request, etag)
+
+    response = await make_response(await render_template('visual.html',
+                    **pages.visual_args(selected, subtype, img_url)))
+    # Don't let clients cache a page missing its plot
+    if img_url is None:
+        return response
+
+    return set_cache_headers(response, etag, last_modified)
+
+
+# Stream hourly data for a time range as csv, ndjson or parquet
+@app.route('/api/data', methods=['GET'])
+async def export_data():
+    format, export_args = pages.export_args(request.args)
+    try:
+        mimetype, rows = service.export_data_async(**export_args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    return Response(rows, mimetype=mimetype, headers=pages.export_headers(format))
+
+
+# Predict daily totals for a grid of weather scenarios on a date
+@app.route('/api/scenarios', methods=['GET'])
+async def scenarios():
+    try:
+        grid = await run_blocking(service.get_scenario_grid, **pages.scenario_args(request.args))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    return jsonify(grid)
+
+
+# Return the model's error statistics over the full history of the data
+@app.route('/api/backtest', methods=['GET'])
+async def backtest():
+    etag, last_modified = pages.backtest_validators(service)
+    response = await not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    results = await run_blocking(service.get_backtest)
+
+    return set_cache_headers(jsonify(results), etag, last_modified)
+
+
+# Return plot rendering counts and timings and the memory use of the data
+@app.route('/api/metrics', methods=['GET'])
+async def metrics():
+    return jsonify(pages.get_metrics(service))
+
+
+# Start the application with the Quart development server
+if __name__ == '__main__':
+    app.run()
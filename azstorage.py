@@ -1,11 +1,19 @@
 import os
-from azure.storage.blob import BlobServiceClient
+from azure.storage.blob import BlobServiceClient, ContentSettings
 from azure.identity import DefaultAzureCredential
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 from werkzeug.utils import secure_filename
-import time
+import json, mimetypes, tempfile, time
 import logging
 
+try:
+    import fcntl
+except ImportError:
+    # File locks are not available on Windows. Workers sharing a cache directory may then
+    # revalidate the same blob at the same time, which is safe but wasteful
+    fcntl = None
+
 logger = logging.getLogger('bike-share-predict')
 
 
@@ -14,10 +22,20 @@ logger = logging.getLogger('bike-share-predict')
 class AzureStorage:
 
     # Initialize the Azure Storage client
-    def __init__(self, storage_url, container_name):
+    # A connection string can be supplied instead of the account URL, e.g. for Azurite or a test stand-in
+    def __init__(self, storage_url, container_name, connection_string=None):
         
         self.account_url = storage_url
         self.container_name = container_name
+
+        if connection_string is not None:
+            try:
+                self.blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+                self.account_url = self.blob_service_client.url
+                self.container_client = self.blob_service_client.get_container_client(self.container_name)
+            except Exception as e:
+                logger.error(e)
+            return
         
         # Acquire a credential object for the app identity. When running in the cloud,
         # DefaultAzureCredential uses the app's managed identity or user-assigned service principal.
@@ -32,12 +50,15 @@ class AzureStorage:
         except Exception as e:
             logger.error(e)
 
-    # Upload blob to Azure Storage
-    def upload_blob(self, file, subfolder=''):
+    # Upload blob to Azure Storage, named after the file unless a blob name is supplied
+    # Optionally set the Cache-Control header the blob is served with
+    def upload_blob(self, file, subfolder='', cache_control=None, blob_name=None):
+        if blob_name is None:
+            blob_name = os.path.basename(file)
         if subfolder == '':
-            target_blob = os.path.basename(file)
+            target_blob = blob_name
         else:
-            target_blob =  subfolder + "/" + os.path.basename(file)
+            target_blob =  subfolder + "/" + blob_name
 
         try:
             # Create a blob client using the local file name as the name for the blob
@@ -55,8 +76,12 @@ class AzureStorage:
 
             # Upload the file and measure upload time
             elapsed_time = time.time()
+            content_settings = None
+            if cache_control is not None:
+                content_settings = ContentSettings(content_type=mimetypes.guess_type(file)[0],
+                                                   cache_control=cache_control)
             with open(file, "rb") as data:
-                blob_client.upload_blob(data)
+                blob_client.upload_blob(data, content_settings=content_settings)
             elapsed_time = round(time.time() - elapsed_time, 2)
             logger.info(f"Upload succeeded after {str(elapsed_time)} seconds for: {target_blob}")
 
@@ -107,6 +132,103 @@ class AzureStorage:
 
         return out_file
 
+    # Download blob to a persistent local cache and return the path of the cached copy
+    # The cached copy is revalidated with a conditional request using its ETag and the blob is only
+    # transferred if it has changed. Workers on the same host share the cache through a file lock
+    def download_blob_cached(self, source_file, cache_dir, source_folder = ''):
+        filename = secure_filename(source_file)
+        if not filename:
+            logger.warning("Must select a file to download first!")
+            return None
+
+        if source_folder == '':
+            target_blob = filename
+        else:
+            target_blob = source_folder + '/' + filename
+
+        # Cached copies are keyed by container and blob name
+        cache_file = os.path.join(cache_dir, self.container_name, *target_blob.split('/'))
+        meta_file = cache_file + '.meta.json'
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+        with open(cache_file + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            meta = None
+            if os.path.isfile(cache_file) and os.path.isfile(meta_file):
+                with open(meta_file) as f:
+                    meta = json.load(f)
+
+            try:
+                blob_client = self.blob_service_client.get_blob_client(container=self.container_name,
+                                                                       blob=target_blob)
+                elapsed_time = time.time()
+                if meta is None:
+                    blob_data = blob_client.download_blob()
+                else:
+                    blob_data = blob_client.download_blob(etag=meta['etag'],
+                                                          match_condition=MatchConditions.IfModified)
+
+                # Write to a temp file in the cache folder and move it into place so other
+                # processes never read a partially downloaded file
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+                try:
+                    with os.fdopen(fd, 'wb') as temp:
+                        blob_data.readinto(temp)
+                    os.replace(temp_path, cache_file)
+                except BaseException:
+                    os.remove(temp_path)
+                    raise
+
+                # The metadata is replaced after the file, if that fails the next start downloads again
+                properties = blob_data.properties
+                meta = {
+                    'etag': properties.etag,
+                    'last_modified': properties.last_modified.isoformat()
+                }
+                self.__write_json(meta_file, meta)
+                elapsed_time = round(time.time() - elapsed_time, 2)
+                logger.info(f"Downloaded {target_blob} to {cache_file} after {elapsed_time} seconds")
+
+            except ResourceNotFoundError:
+                logger.error(f"Download file failed. {target_blob} not found")
+                return None
+
+            except Exception as e:
+                # The storage SDK raises a 304 Not Modified response as an HttpResponseError
+                if isinstance(e, HttpResponseError) and e.status_code == 304:
+                    logger.info(f"{target_blob} not modified since {meta['last_modified']}. Using cached copy {cache_file}")
+                else:
+                    # Fall back to the cached copy if the blob can't be revalidated
+                    logger.error(e)
+                    if meta is None:
+                        return None
+                    logger.warning(f"Could not revalidate {target_blob}. Using cached copy {cache_file}")
+
+        return cache_file
+
+    # Atomically replace a json file
+    def __write_json(self, path, value):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        os.replace(temp_path, path)
+
+    # Return the URL of the blob if it exists in the container, otherwise None
+    def get_blob_url(self, blob_name):
+        try:
+            blob_client = self.blob_service_client.get_blob_client(container=self.container_name,
+                                                                   blob=blob_name)
+            blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(e)
+            return None
+
+        return self.account_url + self.container_name + '/' + blob_name
+
     # Delete specified blob
     def delete_blob(self, blob_name):
         if blob_name is None:
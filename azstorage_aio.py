@@ -0,0 +1,91 @@
+import os
+from azure.storage.blob import ContentSettings
+from azure.storage.blob.aio import BlobServiceClient
+from azure.identity.aio import DefaultAzureCredential
+from azure.core.exceptions import ResourceNotFoundError
+import mimetypes, time
+import logging
+
+logger = logging.getLogger('bike-share-predict')
+
+
+# Async version of AzureStorage for use when serving the application with asyncio
+# Uploads run on the event loop instead of blocking a worker thread
+class AsyncAzureStorage:
+
+    # Initialize the Azure Storage client. Must be created from the event loop
+    def __init__(self, storage_url, container_name, connection_string=None):
+
+        self.account_url = storage_url
+        self.container_name = container_name
+
+        if connection_string is not None:
+            self.credential = None
+            self.blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+            self.account_url = self.blob_service_client.url
+        else:
+            # Uses the same credential sources as AzureStorage
+            self.credential = DefaultAzureCredential()
+            self.blob_service_client = BlobServiceClient(account_url=self.account_url, credential=self.credential)
+
+    # Upload blob to Azure Storage, named after the file unless a blob name is supplied
+    # Optionally set the Cache-Control header the blob is served with
+    async def upload_blob(self, file, subfolder='', cache_control=None, blob_name=None):
+        if blob_name is None:
+            blob_name = os.path.basename(file)
+        if subfolder == '':
+            target_blob = blob_name
+        else:
+            target_blob =  subfolder + "/" + blob_name
+
+        try:
+            blob_client = self.blob_service_client.get_blob_client(container=self.container_name,
+                                                                   blob=(target_blob))
+            try:
+                # Check if blob already exists
+                if (await blob_client.get_blob_properties())['size'] > 0:
+                    logger.warning(f"{target_blob} already exists in the selected path. Skipping upload.")
+                    return None
+            except ResourceNotFoundError:
+                # catch exception that indicates that the blob does not exist and we are good to upload file
+                pass
+            logger.info(f"Uploading {target_blob} to Azure Storage")
+
+            content_settings = None
+            if cache_control is not None:
+                content_settings = ContentSettings(content_type=mimetypes.guess_type(file)[0],
+                                                   cache_control=cache_control)
+            # Upload the file and measure upload time
+            elapsed_time = time.time()
+            with open(file, "rb") as data:
+                await blob_client.upload_blob(data, content_settings=content_settings)
+            elapsed_time = round(time.time() - elapsed_time, 2)
+            logger.info(f"Upload succeeded after {str(elapsed_time)} seconds for: {target_blob}")
+
+        except Exception as e:
+            logger.error(e)
+            return None
+
+        blob_url = self.account_url + self.container_name + '/' + target_blob
+
+        return blob_url
+
+    # Return the URL of the blob if it exists in the container, otherwise None
+    async def get_blob_url(self, blob_name):
+        try:
+            blob_client = self.blob_service_client.get_blob_client(container=self.container_name,
+                                                                   blob=blob_name)
+            await blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(e)
+            return None
+
+        return self.account_url + self.container_name + '/' + blob_name
+
+    # Close the client connections
+    async def close(self):
+        await self.blob_service_client.close()
+        if self.credential is not None:
+            await self.credential.close()
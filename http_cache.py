@@ -0,0 +1,61 @@
+# HTTP cache validator helpers shared by the Flask and the ASGI (Quart) applications
+import datetime as dt
+import hashlib, os
+
+# Cache lifetime in seconds for pages that don't depend on the data
+static_page_max_age = 3600
+
+# Rendered plot images are never modified after creation
+plot_cache_control = 'public, max-age=31536000, immutable'
+
+
+# Return True if the client's cached copy matches the supplied validators
+# Checked before any data is queried or plotted so revalidation stays cheap
+def is_not_modified(request, etag, last_modified=None):
+    since = request.if_modified_since
+    if request.if_none_match:
+        # If-None-Match uses the weak comparison, so W/ tags added by proxies or compression still match
+        return request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and since is not None:
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=dt.timezone.utc)
+        return last_modified <= since
+
+    return False
+
+
+# Set validators on the response. Pages default to being revalidated on every use
+def set_cache_headers(response, etag, last_modified=None, max_age=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    if max_age is None:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.max_age = max_age
+
+    return response
+
+
+# Return validators for tomorrow's forecast page or None if no forecast is cached
+# The ETag is taken from the forecast values rather than the time they were retrieved, so
+# workers that retrieved the same forecast separately return the same ETag
+def forecast_validators(cached, *parts):
+    if cached is None:
+        return None, None
+
+    forecast = sorted(cached['forecast'].items())
+    key = '|'.join(['index', str(dt.date.today()), str(forecast)] + [str(part) for part in parts])
+    etag = hashlib.md5(key.encode()).hexdigest()
+    return etag, dt.datetime.fromtimestamp(int(cached['time']), dt.timezone.utc)
+
+
+# Return a validator for pages rendered only from templates. Changes when the templates are redeployed
+def template_etag(template_dir, *templates):
+    digest = hashlib.md5()
+    for template in templates:
+        with open(os.path.join(template_dir, template), 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
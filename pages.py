@@ -0,0 +1,135 @@
+# Page logic shared by the Flask (app.py) and the ASGI (Quart) applications
+# Parses request arguments, provides cache validators and builds template arguments so the
+# entry points only call the service and build their framework's responses
+import os
+import logging
+
+from http_cache import template_etag
+
+# Messages shown above the prediction results
+tomorrow_message = "Tomorrow's Estimated Ride counts"
+
+
+# Configure the default and application loggers
+def configure_logging():
+    # Configure Default Logger
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.WARNING)
+
+    # Configure App Logger
+    logger = logging.getLogger('bike-share-predict')
+    logger.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', "%Y-%m-%d %H:%M:%S")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+
+# Return the validator of the prediction form page. Changes when the templates are redeployed
+def predict_etag(app):
+    return template_etag(os.path.join(app.root_path, app.template_folder), 'base.html', 'predict.html')
+
+
+# Return the version of the templates of the pages embedding a plot
+def plot_page_version(app):
+    return template_etag(os.path.join(app.root_path, app.template_folder), 'base.html', 'main.html', 'visual.html')
+
+
+def form_message(form):
+    return f"Estimated Ride counts for {form['date']}"
+
+
+# Return the arguments of the prediction results page
+def prediction_args(message, results, predictions, img_url):
+    return dict(message=message,
+                results=results,
+                sum=predictions.sum(),
+                img_url=img_url)
+
+
+def data_page_url(page):
+    return f"/data?page={page}"
+
+
+# Return the requested data page number and None, or None and the URL to redirect to
+# if the page number is invalid or outside the data
+def get_page(args, max_page):
+    # Get page number if supplied
+    page = args.get('page')
+    if page is None:
+        return 1, None
+
+    try:
+        page = int(page)
+    except ValueError:
+        return None, data_page_url(1)
+    if page > max_page:
+        return None, data_page_url(max_page)
+    elif page < 1:
+        return None, data_page_url(1)
+
+    return page, None
+
+
+# Return True if the edit param was set to true
+def get_edit(args):
+    edit_flag = args.get('edit')
+    return edit_flag is not None and edit_flag.lower() == "true"
+
+
+def save_message(url):
+    return f"Data saved to {url}"
+
+
+# Return the validators of a data page or None if the page can't be cached
+def data_validators(service, args, page, edit):
+    # Pages can be revalidated from the data version unless a save was requested
+    if args.get('save'):
+        return None, None
+
+    return service.data.etag('data', page, edit), service.data.last_modified
+
+
+# Return the arguments of a data page
+def data_args(service, page, edit, message):
+    values = service.get_data(page=page)
+    # convert to list of dict
+    values = values.to_dict(orient='records')
+
+    return dict(columns=service.data.display_columns,
+                values=values,
+                edit=edit,
+                page=page,
+                max_page=service.data.max_page,
+                message=message)
+
+
+def visuals_validators(service, args):
+    return service.get_visuals_validators(args.get('type'), args.get('subtype'))
+
+
+def visual_args(selected, subtype, img_url):
+    return dict(img_url=img_url, type=selected, subtype=subtype)
+
+
+# Return the requested export format and the time range and format arguments of the export
+def export_args(args):
+    format = args.get('format', 'csv')
+    return format, dict(start=args.get('from'), end=args.get('to'), format=format)
+
+
+def export_headers(format):
+    return {'Content-Disposition': f'attachment; filename=hourly_rides.{format}'}
+
+
+def scenario_args(args):
+    return {name: args.get(name) for name in ['date', 'hitemp', 'wind', 'rain', 'snow']}
+
+
+def backtest_validators(service):
+    return service.data.etag('backtest', service.model.version), service.data.last_modified
+
+
+# Return plot rendering counts and timings and the memory use of the data
+def get_metrics(service):
+    return {'render': service.get_render_metrics(), 'data': service.get_data_metrics()}
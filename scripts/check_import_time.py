@@ -0,0 +1,127 @@
+# Import-time budget check for the application start path
+# Runs python with import profiling (`-X importtime`) importing app.py, which initializes the service, in local storage mode
+# against a small data file. Fails if a deferred dependency is imported at start or the total
+# import time exceeds the budget.
+#
+# Usage: python scripts/check_import_time.py [--budget-ms 2500] [--entry app|asgi]
+
+import argparse, os, re, shutil, subprocess, sys, tempfile
+
+# Application entry modules. Importing either starts the service
+entry_modules = ['app', 'asgi']
+
+# Environment variables that would switch the service to Azure storage
+azure_variables = ['AZURE_STORAGE_ACCOUNT_URL', 'AZURE_STORAGE_CONNECTION_STRING']
+
+# Import profiling is enabled through the environment, which is cleared before the import so
+# spawned plot rendering processes don't inherit it. Forked processes inherit the profiling of the
+# parent so their stderr is discarded where fork is available. Their imports aren't part of the start path
+measure_code = """
+import os
+os.environ.pop('PYTHONPROFILEIMPORTTIME', None)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: os.dup2(os.open(os.devnull, os.O_WRONLY), 2))
+import {module}
+"""
+
+# Dependencies that must only be imported on first use
+deferred_modules = [
+    'tensorflow',
+    'matplotlib',
+    'seaborn',
+    'azure',
+    'pandas.tseries.holiday',
+    'requests'
+]
+
+default_budget_ms = 2500
+
+repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Lines look like: "import time:       381 |       1130 |   encodings"
+importtime_line = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+# Write a day of prepared hourly data in the layout of hourly_rides.csv
+def write_sample_data(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('Timestamp,Ride count,Hour,Day of week,Month,Day of year,Weekend,Year,'
+                'Wind,Rain,Snow,Average temp,Hi temp,Lo temp,Holiday,Season\n')
+        for hour in range(24):
+            f.write(f"2020-06-01 {hour:02d}:00:00,{100 + hour},{hour},0,6,153,0,2020,"
+                    f"5.0,0.0,0.0,70.0,80.0,60.0,0,3\n")
+
+
+# Return dicts of module name to cumulative import time in microseconds
+# for every imported module and for the modules imported directly
+# The entry module is imported from a working directory holding a sample data file
+def measure_imports(module):
+    work_dir = tempfile.mkdtemp(prefix='import-time-')
+    try:
+        write_sample_data(os.path.join(work_dir, 'data', 'prepared', 'hourly_rides.csv'))
+        # The model is only loaded on the first prediction but its files identify its version
+        models_dir = os.path.join(repo_dir, 'models')
+        if os.path.isdir(models_dir) and hasattr(os, 'symlink'):
+            os.symlink(models_dir, os.path.join(work_dir, 'models'))
+
+        env = {name: value for name, value in os.environ.items() if name not in azure_variables}
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [repo_dir, env.get('PYTHONPATH')]))
+        env.setdefault('WEATHER_API_KEY', 'import-time-check')
+        env['PYTHONPROFILEIMPORTTIME'] = '1'
+        result = subprocess.run([sys.executable, '-c', measure_code.format(module=module)],
+                                cwd=work_dir, env=env, capture_output=True, text=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        raise SystemExit(f"Importing {module} failed")
+
+    imported = dict()
+    top_level = dict()
+    for line in result.stderr.splitlines():
+        match = importtime_line.match(line)
+        if match is None:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        imported[name] = cumulative
+        # Modules imported directly by the -c code aren't nested
+        if indent == 1:
+            top_level[name] = cumulative
+
+    return imported, top_level
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of the application start path')
+    parser.add_argument('--budget-ms', type=float, default=default_budget_ms,
+                        help='Maximum total import time in milliseconds')
+    parser.add_argument('--entry', choices=entry_modules, default='app',
+                        help='Application module to import')
+    args = parser.parse_args()
+
+    imported, top_level = measure_imports(args.entry)
+    total_ms = top_level.get(args.entry, 0) / 1000
+
+    # Show the slowest imports on the start path
+    for name, cumulative in sorted(imported.items(), key=lambda item: -item[1])[:15]:
+        print(f"{cumulative / 1000:10.1f} ms  {name}")
+    print(f"{total_ms:10.1f} ms  total (budget {args.budget_ms:.0f} ms)")
+
+    failures = []
+    for module in deferred_modules:
+        loaded = [name for name in imported if name == module or name.startswith(module + '.')]
+        if loaded:
+            failures.append(f"{module} is imported at start and should be imported on first use")
+    if total_ms > args.budget_ms:
+        failures.append(f"Import time {total_ms:.0f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+# Local stand-ins for the OpenWeatherMap API and Azure Blob Storage
+# Used by the load test so the application can run offline without accounts or network access.
+# The blob stand-in implements the subset of the Blob REST API the application uses and accepts
+# any credentials, like Azurite's in-memory mode.
+#
+# Usage: python scripts/fake_services.py [--weather-port 8081] [--blob-port 10000]
+# Prints the environment variables that point the application at the stand-ins.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import escape
+import argparse, email.utils, hashlib, json, random, re, threading, time
+
+# Well known development storage account used by Azurite and the Azure Storage emulator
+blob_account = 'devstoreaccount1'
+blob_account_key = 'Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=='
+
+
+# Base class for the stand-in servers. Serves on a background thread
+class FakeServer:
+    handler = None
+
+    def __init__(self, port=0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler)
+        self.server.daemon_threads = True
+        self.server.service = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Don't log every request
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+class _WeatherHandler(_Handler):
+
+    def do_GET(self):
+        service = self.server.service
+        service.count_request()
+        if service.latency > 0:
+            time.sleep(service.latency)
+
+        body = json.dumps(service.forecast).encode()
+        self.send(200, body, {'Content-Type': 'application/json'})
+
+
+# Serves the same 8 day daily forecast for every onecall request
+# The forecast values are generated from the seed so runs are reproducible
+class FakeWeatherServer(FakeServer):
+    handler = _WeatherHandler
+
+    def __init__(self, port=0, seed=0, latency=0.0):
+        super().__init__(port)
+        self.latency = latency
+
+        rng = random.Random(seed)
+        daily = []
+        for day in range(8):
+            low = round(rng.uniform(30, 70), 1)
+            forecast = {
+                'temp': {'min': low, 'max': round(low + rng.uniform(5, 25), 1)},
+                'wind_speed': round(rng.uniform(0, 15), 1)
+            }
+            # Rain and snow are only returned by the API when forecast
+            if rng.random() < 0.3:
+                forecast['rain'] = round(rng.uniform(0.5, 20), 1)
+            daily.append(forecast)
+        self.forecast = {'daily': daily}
+
+
+class _BlobHandler(_Handler):
+
+    # Return the container and blob name of the request path /<account>/<container>/<blob>
+    def get_target(self):
+        parts = urlsplit(self.path).path.lstrip('/').split('/', 2)
+        container = parts[1] if len(parts) > 1 else ''
+        blob = parts[2] if len(parts) > 2 else ''
+        return container, blob
+
+    def send_blob_error(self, status, code):
+        self.send(status, headers={'x-ms-error-code': code, 'x-ms-version': self.server.service.version})
+
+    def blob_headers(self, entry):
+        return {
+            'ETag': entry['etag'],
+            'Last-Modified': entry['last_modified'],
+            'Content-Type': entry['content_type'],
+            'x-ms-blob-type': 'BlockBlob',
+            'x-ms-version': self.server.service.version
+        }
+
+    def do_GET(self):
+        service = self.server.service
+        service.count_request()
+        container, blob = self.get_target()
+        query = parse_qs(urlsplit(self.path).query)
+        if query.get('comp') == ['list']:
+            return self.send(200, service.list_xml(container),
+                             {'Content-Type': 'application/xml', 'x-ms-version': service.version})
+
+        entry = service.get(container, blob)
+        if entry is None:
+            return self.send_blob_error(404, 'BlobNotFound')
+        if self.headers.get('If-None-Match') == entry['etag']:
+            return self.send(304, headers=self.blob_headers(entry))
+
+        data = entry['data']
+        headers = self.blob_headers(entry)
+        byte_range = self.headers.get('x-ms-range') or self.headers.get('Range')
+        if byte_range is None:
+            return self.send(200, data, headers)
+
+        start, end = [int(value) for value in re.match(r'bytes=(\d+)-(\d*)', byte_range).groups()]
+        if start >= len(data):
+            return self.send_blob_error(416, 'InvalidRange')
+        end = min(end, len(data) - 1)
+        headers['Content-Range'] = f"bytes {start}-{end}/{len(data)}"
+        self.send(206, data[start:end + 1], headers)
+
+    def do_HEAD(self):
+        service = self.server.service
+        service.count_request()
+        entry = service.get(*self.get_target())
+        if entry is None:
+            return self.send_blob_error(404, 'BlobNotFound')
+
+        headers = self.blob_headers(entry)
+        headers['Content-Length'] = str(len(entry['data']))
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_PUT(self):
+        service = self.server.service
+        service.count_request()
+        container, blob = self.get_target()
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        # Uploads without overwrite only succeed if the blob doesn't exist
+        if self.headers.get('If-None-Match') == '*' and service.get(container, blob) is not None:
+            return self.send_blob_error(409, 'BlobAlreadyExists')
+
+        if blob:
+            content_type = self.headers.get('x-ms-blob-content-type', 'application/octet-stream')
+            entry = service.put(container, blob, data, content_type)
+            headers = {'ETag': entry['etag'], 'Last-Modified': entry['last_modified']}
+        else:
+            # Container creation
+            headers = {}
+        headers['x-ms-version'] = service.version
+        headers['x-ms-request-server-encrypted'] = 'true'
+        self.send(201, headers=headers)
+
+    def do_DELETE(self):
+        service = self.server.service
+        service.count_request()
+        if not service.delete(*self.get_target()):
+            return self.send_blob_error(404, 'BlobNotFound')
+        self.send(202, headers={'x-ms-version': service.version})
+
+
+# In-memory blob storage serving the Blob REST API at /<account>/<container>/<blob>
+# Supports ranged and conditional downloads, uploads, properties, deletes and listing
+class FakeBlobServer(FakeServer):
+    handler = _BlobHandler
+    version = '2020-04-08'
+
+    def __init__(self, port=0):
+        super().__init__(port)
+        self.blobs = dict()
+
+    @property
+    def connection_string(self):
+        return (f"DefaultEndpointsProtocol=http;AccountName={blob_account};AccountKey={blob_account_key};"
+                f"BlobEndpoint={self.url}/{blob_account};")
+
+    def get(self, container, blob):
+        with self.lock:
+            return self.blobs.get((container, blob))
+
+    def put(self, container, blob, data, content_type='application/octet-stream'):
+        entry = {
+            'data': bytes(data),
+            'etag': '"0x' + hashlib.md5(data).hexdigest()[:16].upper() + '"',
+            'last_modified': email.utils.formatdate(time.time(), usegmt=True),
+            'content_type': content_type
+        }
+        with self.lock:
+            self.blobs[(container, blob)] = entry
+        return entry
+
+    def delete(self, container, blob):
+        with self.lock:
+            return self.blobs.pop((container, blob), None) is not None
+
+    # Return the list blobs response for the container
+    def list_xml(self, container):
+        with self.lock:
+            entries = sorted((blob, entry) for (name, blob), entry in self.blobs.items() if name == container)
+
+        blobs = ''.join(
+            f"<Blob><Name>{escape(blob)}</Name><Properties>"
+            f"<Last-Modified>{entry['last_modified']}</Last-Modified><Etag>{entry['etag']}</Etag>"
+            f"<Content-Length>{len(entry['data'])}</Content-Length>"
+            f"<Content-Type>{escape(entry['content_type'])}</Content-Type>"
+            f"<BlobType>BlockBlob</BlobType></Properties></Blob>"
+            for blob, entry in entries)
+
+        return ('<?xml version="1.0" encoding="utf-8"?>'
+                f'<EnumerationResults ServiceEndpoint="{self.url}/{blob_account}/" ContainerName="{escape(container)}">'
+                f'<Blobs>{blobs}</Blobs><NextMarker /></EnumerationResults>').encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve stand-ins for the weather API and blob storage')
+    parser.add_argument('--weather-port', type=int, default=8081)
+    parser.add_argument('--blob-port', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the forecast values')
+    args = parser.parse_args()
+
+    weather = FakeWeatherServer(args.weather_port, seed=args.seed).start()
+    blob = FakeBlobServer(args.blob_port).start()
+    print(f"WEATHER_API_URL={weather.url}/data/2.5/onecall")
+    print(f"AZURE_STORAGE_CONNECTION_STRING={blob.connection_string}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        weather.stop()
+        blob.stop()
+
+
+if __name__ == '__main__':
+    main()
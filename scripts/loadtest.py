@@ -0,0 +1,490 @@
+# Offline load test of the application
+# Generates a reproducible synthetic ride data set and starts the application as a subprocess
+# against local stand-ins for the weather API and Azure Blob Storage. The routes in the mix are
+# then each driven at a fixed concurrency and request rate, followed by all of them together.
+# Latency percentiles, throughput, error rate and the RSS of the server processes are
+# reported per route as JSON.
+#
+# Usage: python scripts/loadtest.py [--duration 10] [--concurrency 8] [--rate 20]
+#            [--mix index=2,predict_post=2,data=3,data_edit=1,visuals=2] [--server flask|asgi]
+#            [--output results.json]
+
+import argparse, json, os, random, shutil, signal, subprocess, sys, tempfile, threading, time
+
+repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, repo_dir)
+
+import numpy as np
+import pandas as pd
+import requests
+
+from BikeShare.calendar import holiday_flags
+from BikeShare.ingest import prepared_columns
+from fake_services import FakeBlobServer, FakeWeatherServer
+
+data_container = 'data'
+image_container = 'images'
+data_filename = 'hourly_rides.csv'
+
+# Rows per page of the data view
+page_rows = 50
+
+default_mix = 'index=2,predict=1,predict_post=2,data=3,data_edit=1,visuals=2'
+
+visual_types = [('rides', subtype) for subtype in ['week', 'year', 'alltime', 'monthly', 'temp', 'wind', 'accuracy']] + \
+               [('weather', subtype) for subtype in ['temp', 'wind', 'rain']]
+
+
+# Generate hourly ride data in the prepared file layout for the years ending at end_year
+# Ride counts follow a daily and seasonal cycle with noise so plots and aggregations have realistic shapes
+def generate_data(path, years, seed, end_year=2020):
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(f'{end_year - years + 1}-01-01', f'{end_year}-12-31 23:00', freq='h')
+    days = len(timestamps) // 24
+
+    # Daily weather values repeated for each hour of the day
+    season = -np.cos(2 * np.pi * (timestamps.dayofyear.values - 15) / 365)
+    hi_temp = np.repeat(np.round(60 + 25 * season[::24] + rng.normal(0, 6, days)), 24)
+    lo_temp = hi_temp - np.repeat(np.round(rng.uniform(8, 20, days)), 24)
+    wind = np.repeat(np.round(rng.gamma(4, 2, days), 2), 24)
+    rain = np.repeat(np.round(np.where(rng.random(days) < 0.3, rng.gamma(1, 0.3, days), 0), 2), 24)
+    snow = np.repeat(np.round(np.where((rng.random(days) < 0.1) & (season[::24] < -0.5),
+                                       rng.gamma(1, 1, days), 0), 1), 24)
+
+    hours = timestamps.hour.values
+    weekend = (timestamps.dayofweek.values > 4).astype(int)
+    # Commute peaks on weekdays, a midday peak on weekends
+    daily_cycle = np.where(weekend == 1,
+                           np.exp(-((hours - 14) / 4) ** 2),
+                           np.exp(-((hours - 8) / 1.5) ** 2) + np.exp(-((hours - 17.5) / 2) ** 2))
+    rides = 40 + 700 * daily_cycle * (1.2 + 0.6 * season) * np.where(rain > 0.2, 0.5, 1.0)
+    rides = np.maximum(rng.normal(rides, rides * 0.1), 0).astype(int)
+
+    months = timestamps.month.values
+    data_df = pd.DataFrame({
+        'Timestamp': timestamps,
+        'Ride count': rides,
+        'Hour': hours,
+        'Day of week': timestamps.dayofweek.values,
+        'Month': months,
+        'Day of year': timestamps.dayofyear.values,
+        'Weekend': weekend,
+        'Year': timestamps.year.values,
+        'Wind': wind,
+        'Rain': rain,
+        'Snow': snow,
+        'Average temp': np.round((hi_temp + lo_temp) / 2),
+        'Hi temp': hi_temp,
+        'Lo temp': lo_temp,
+        'Holiday': holiday_flags(timestamps).astype(int),
+        # Winter 1, Spring 2, Summer 3, Fall 4 based on month
+        'Season': np.array([1, 1, 2, 2, 2, 3, 3, 3, 4, 4, 4, 1])[months - 1]
+    })
+    data_df[prepared_columns].to_csv(path, index=False)
+
+    return data_df['Timestamp']
+
+
+# Builds the request for each route. Parameters are drawn from the supplied random generator
+class RouteRequests:
+
+    def __init__(self, timestamps):
+        self.timestamps = timestamps.dt.strftime('%Y-%m-%d %H:%M:%S').tolist()
+        self.max_page = (len(self.timestamps) + page_rows - 1) // page_rows
+        self.routes = {
+            'index': self.index,
+            'predict': self.predict,
+            'predict_post': self.predict_post,
+            'data': self.data,
+            'data_edit': self.data_edit,
+            'visuals': self.visuals,
+            'scenarios': self.scenarios,
+            'export': self.export,
+            'backtest': self.backtest
+        }
+
+    # Return the method, path and form data of a request to the route
+    def get(self, route, rng):
+        return self.routes[route](rng)
+
+    def index(self, rng):
+        return 'GET', '/', None
+
+    def predict(self, rng):
+        return 'GET', '/predict', None
+
+    def predict_post(self, rng):
+        date = pd.Timestamp('2021-01-01') + pd.Timedelta(days=rng.randrange(365))
+        return 'POST', '/', {
+            'date': date.strftime('%Y-%m-%d'),
+            'hitemp': str(rng.randrange(20, 100)),
+            'wind': str(round(rng.uniform(0, 20), 1)),
+            'precip': str(round(rng.choice([0, 0, 0, rng.uniform(0, 2)]), 2)),
+            'snow': str(rng.choice([0, 0, 0, 0, 1]))
+        }
+
+    def data(self, rng):
+        return 'GET', f'/data?page={rng.randrange(1, self.max_page + 1)}', None
+
+    def data_edit(self, rng):
+        row = rng.randrange(len(self.timestamps))
+        page = row // page_rows + 1
+        return 'POST', f'/data?page={page}&timestamp={self.timestamps[row]}', {
+            'Ride count': str(rng.randrange(0, 1000)),
+            'Wind': str(round(rng.uniform(0, 20), 1)),
+            'Rain': str(round(rng.uniform(0, 1), 2)),
+            'Snow': '0',
+            'Hi temp': str(rng.randrange(20, 100)),
+            'Lo temp': str(rng.randrange(0, 60))
+        }
+
+    def visuals(self, rng):
+        data_type, subtype = rng.choice(visual_types)
+        return 'GET', f'/visuals?type={data_type}&subtype={subtype}', None
+
+    def scenarios(self, rng):
+        date = pd.Timestamp('2021-01-01') + pd.Timedelta(days=rng.randrange(365))
+        return 'GET', f"/api/scenarios?date={date.strftime('%Y-%m-%d')}&hitemp=30:100:1&rain=0:2:0.25", None
+
+    def export(self, rng):
+        start = pd.Timestamp(self.timestamps[rng.randrange(len(self.timestamps))]).normalize()
+        return 'GET', f"/api/data?from={start.strftime('%Y-%m-%d')}&to={(start + pd.Timedelta(days=30)).strftime('%Y-%m-%d')}", None
+
+    def backtest(self, rng):
+        return 'GET', '/api/backtest', None
+
+
+# Return the combined resident set size in MB of the process and all of its descendants
+# Returns None where /proc is not available
+def process_tree_rss(pid):
+    if not os.path.isdir('/proc'):
+        return None
+
+    children = dict()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The parent pid follows the command name, which may contain spaces
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+
+    rss = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1])
+        except OSError:
+            continue
+
+    return round(rss / 1024, 1)
+
+
+# Samples the RSS of the server processes in the background
+class RssSampler:
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = process_tree_rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+    def summary(self):
+        if not self.samples:
+            return None
+        return {'start': self.samples[0], 'peak': max(self.samples), 'end': self.samples[-1]}
+
+
+# Return the latency percentiles in milliseconds
+def latency_summary(latencies):
+    if not latencies:
+        return None
+
+    values = np.array(latencies) * 1000
+    return {
+        'p50': round(float(np.percentile(values, 50)), 1),
+        'p95': round(float(np.percentile(values, 95)), 1),
+        'p99': round(float(np.percentile(values, 99)), 1),
+        'mean': round(float(values.mean()), 1),
+        'max': round(float(values.max()), 1)
+    }
+
+
+def route_summary(results, elapsed):
+    errors = sum(1 for result in results if not result['ok'])
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4) if results else 0.0,
+        'throughput': round(len(results) / elapsed, 2),
+        'latency_ms': latency_summary([result['latency'] for result in results])
+    }
+
+
+# Send requests for the weighted mix of routes for the duration
+# Requests are scheduled at a fixed rate and sent by a fixed number of concurrent clients.
+# Latency is measured from the scheduled send time so requests delayed behind slow responses
+# are counted. A rate of 0 sends requests as fast as the clients can.
+def run_phase(name, base_url, route_requests, mix, duration, concurrency, rate, seed, server_pid):
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    results = []
+    lock = threading.Lock()
+    counter = iter(range(sys.maxsize))
+
+    start = time.perf_counter()
+    end = start + duration
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                index = next(counter)
+            scheduled = start + index / rate if rate > 0 else time.perf_counter()
+            if scheduled >= end:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            # Each request is drawn from its own generator so runs are reproducible
+            rng = random.Random(f"{seed}-{name}-{index}")
+            route = rng.choices(routes, weights)[0]
+            method, path, form = route_requests.get(route, rng)
+            try:
+                response = session.request(method, base_url + path, data=form,
+                                           allow_redirects=False, timeout=60)
+                # Read the whole body, exports are streamed
+                response.content
+                ok = response.status_code < 400
+                status = response.status_code
+            except requests.RequestException as e:
+                ok = False
+                status = type(e).__name__
+            latency = time.perf_counter() - scheduled
+
+            with lock:
+                results.append({'route': route, 'ok': ok, 'status': status, 'latency': latency})
+
+    with RssSampler(server_pid) as sampler:
+        clients = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+    elapsed = time.perf_counter() - start
+
+    summary = route_summary(results, elapsed)
+    summary['rss_mb'] = sampler.summary()
+    statuses = dict()
+    for result in results:
+        statuses[str(result['status'])] = statuses.get(str(result['status']), 0) + 1
+    summary['statuses'] = statuses
+    if len(routes) > 1:
+        summary['routes'] = {route: route_summary([result for result in results if result['route'] == route],
+                                                  elapsed)
+                             for route in routes}
+
+    return summary
+
+
+# Parse a mix like index=2,data=3 into a dict of route to weight
+def parse_mix(value, available):
+    mix = dict()
+    for item in value.split(','):
+        route, _, weight = item.partition('=')
+        route = route.strip()
+        if route not in available:
+            raise argparse.ArgumentTypeError(f"Unknown route {route}. Use one of: {', '.join(available)}")
+        try:
+            mix[route] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Weight of {route} must be a number")
+
+    return mix
+
+
+# Start the application server and return the process
+def start_server(server, port, workers, env, log_file):
+    if server == 'asgi':
+        command = [sys.executable, '-m', 'hypercorn', 'asgi:app',
+                   '--bind', f'127.0.0.1:{port}', '--workers', str(workers)]
+    else:
+        env['FLASK_APP'] = 'app.py'
+        command = [sys.executable, '-m', 'flask', 'run', '--host', '127.0.0.1', '--port', str(port),
+                   '--with-threads', '--no-reload']
+
+    # Start in a new session so the server and its worker processes can be stopped together
+    # Process groups are only available on POSIX systems
+    return subprocess.Popen(command, cwd=repo_dir, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+                            start_new_session=hasattr(os, 'killpg'))
+
+
+# Stop the server and its worker processes. Where process groups aren't available,
+# such as on Windows, only the server process itself is signalled
+def stop_server(process):
+    if process.poll() is None:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            if hasattr(os, 'killpg'):
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+            process.wait()
+
+
+def wait_until_ready(process, base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if requests.get(base_url + '/predict', timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+
+    raise RuntimeError(f"Server not ready after {timeout} seconds")
+
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the application against local stand-in services',
+                                     epilog='Server RSS is only reported on Linux. Without process groups, '
+                                            'e.g. on Windows, server worker processes may be left running')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run each phase')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--rate', type=float, default=20.0,
+                        help='Requests per second to send. 0 sends requests as fast as possible')
+    parser.add_argument('--mix', default=default_mix,
+                        help=f'Comma separated route=weight pairs (default {default_mix})')
+    parser.add_argument('--no-isolated', action='store_true',
+                        help='Only run the mixed phase instead of each route on its own first')
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask',
+                        help='Run app.py with the Flask server or asgi.py with hypercorn')
+    parser.add_argument('--workers', type=int, default=1, help='Number of hypercorn worker processes')
+    parser.add_argument('--years', type=int, default=3, help='Years of synthetic ride data')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the data, forecasts and requests')
+    parser.add_argument('--weather-latency-ms', type=float, default=100.0,
+                        help='Response time of the stand-in weather API')
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--output', help='File to write the JSON results to. Defaults to stdout')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bike-share-loadtest-')
+    data_file = os.path.join(work_dir, data_filename)
+    timestamps = generate_data(data_file, args.years, args.seed)
+    route_requests = RouteRequests(timestamps)
+    try:
+        mix = parse_mix(args.mix, route_requests.routes)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    weather = FakeWeatherServer(seed=args.seed, latency=args.weather_latency_ms / 1000).start()
+    blob = FakeBlobServer().start()
+    with open(data_file, 'rb') as f:
+        blob.put(data_container, data_filename, f.read(), 'text/csv')
+
+    env = dict(os.environ)
+    env.update({
+        'WEATHER_API_KEY': 'loadtest',
+        'WEATHER_API_URL': f'{weather.url}/data/2.5/onecall',
+        'AZURE_STORAGE_CONNECTION_STRING': blob.connection_string,
+        'AZURE_STORAGE_DATA_CONTAINER_NAME': data_container,
+        'AZURE_STORAGE_IMAGE_CONTAINER_NAME': image_container,
+        'BLOB_CACHE_DIR': os.path.join(work_dir, 'blob-cache')
+    })
+    env.pop('AZURE_STORAGE_ACCOUNT_URL', None)
+
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    log_path = os.path.join(work_dir, 'server.log')
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'mix': mix,
+        'server_log': log_path,
+        'phases': {}
+    }
+    report['config']['rows'] = len(timestamps)
+
+    with open(log_path, 'w') as log_file:
+        started = time.time()
+        process = start_server(args.server, port, args.workers, env, log_file)
+        try:
+            try:
+                wait_until_ready(process, base_url, args.startup_timeout)
+            except RuntimeError as e:
+                print(f"{e}. See the server log {log_path}", file=sys.stderr)
+                return 1
+            report['startup_seconds'] = round(time.time() - started, 2)
+
+            # Send one request to each route so the model is loaded and caches are warm
+            started = time.time()
+            for route in mix:
+                method, path, form = route_requests.get(route, random.Random(f"{args.seed}-warmup-{route}"))
+                requests.request(method, base_url + path, data=form, allow_redirects=False, timeout=120)
+            report['warmup_seconds'] = round(time.time() - started, 2)
+
+            phases = [] if args.no_isolated or len(mix) == 1 else [(route, {route: 1.0}) for route in mix]
+            phases.append(('mix', mix))
+            for name, phase_mix in phases:
+                print(f"Running {name} for {args.duration:.0f} seconds", file=sys.stderr)
+                report['phases'][name] = run_phase(name, base_url, route_requests, phase_mix, args.duration,
+                                                   args.concurrency, args.rate, args.seed, process.pid)
+        finally:
+            stop_server(process)
+            weather.stop()
+            blob.stop()
+
+    report['weather_requests'] = weather.requests
+    report['blob_requests'] = blob.requests
+    shutil.rmtree(os.path.join(work_dir, 'blob-cache'), ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,66 +2,144 @@
 # https://openweathermap.org/api/one-call-api
 # Created by Tyler Sorensen
 
-import requests
+import datetime as dt
+import time
 import logging
 
 logger = logging.getLogger('bike-share-predict')
 
+# URL of the onecall API that can return different weather sets
+default_api_url = "https://api.openweathermap.org/data/2.5/onecall"
+
 # Class for interacting with OpenWeatherMap API
 class Weather:
 
   # Set default location to Washington Reagan airport
-  def __init__(self, api_key, lat = "38.85", lon = "-77.03"):
+  # Forecasts are cached for cache_ttl seconds to avoid an API call for every page load
+  # The API URL can be replaced to use a stand-in for the weather service
+  def __init__(self, api_key, lat = "38.85", lon = "-77.03", cache_ttl = 3600, api_url = default_api_url):
       
       self.api_key = api_key
-      # Set URL to onecall API that can return different weather sets
-      self.api_url = "https://api.openweathermap.org/data/2.5/onecall"
+      self.api_url = api_url
       
       self.latitude = lat
       self.longitude = lon
 
+      self.cache_ttl = cache_ttl
+      self.forecast_cache = dict()
+      # HTTP session for async requests, created on first use
+      self.session = None
+
+  # Return the time the cached forecast was retrieved or None if there is no current forecast
+  def get_forecast_time(self, day: int = 1, units = 'imperial'):
+    cached = self.__get_cached(day, units)
+    if cached is None:
+      return None
+
+    return cached['time']
+
+  # Return the cached forecast for the day with the time it was retrieved or None if there is no current forecast
+  def get_cached_forecast(self, day: int = 1, units = 'imperial'):
+    return self.__get_cached(day, units)
+
   # Return the forecast x days from the current date (0-7)
   # Defaults to tomorrow and imperial units
   def get_daily_forecast(self, day: int = 1, units = 'imperial'):
     
     if  0 <= day <= 7:
-      # Configure query parameters
-      query_params = {
-        'lat': self.latitude,
-        'lon': self.longitude,
-        # exclude all weather info but daily forecast
-        'exclude': 'current,minutely,hourly,alerts',
-        'appid': self.api_key,
-        'units': units
-      }
+      # Return the cached forecast if it is still current
+      cached = self.__get_cached(day, units)
+      if cached is not None:
+        return cached['forecast']
+
+      # Imported on first use to keep application start fast
+      import requests
 
       # Send the API request and parse json for the requested day
       response = requests.get(self.api_url, 
-            params=query_params).json()['daily'][day]
+            params=self.__get_query_params(units)).json()['daily'][day]
 
-      forecast = dict()
+      return self.__store_forecast(response, day, units)
 
-      forecast['temp_max'] = round(response['temp']['min'], 1)
-      forecast['temp_min'] = round(response['temp']['max'], 1)
-      forecast['wind_speed'] = round(response['wind_speed'], 1)
-      
-      # These values aren't always returned. Set to 0 if not found
-      try:
-        forecast['rain'] = self.__mm_to_inch(response['rain'])
-      except KeyError:
-        forecast['rain'] = 0.0
+    else:
+      logger.warning("Requested forecast day outside of available range (0-7 days)")
+      return "Forecast not found"
+
+  # Return the forecast x days from the current date (0-7) without blocking the event loop
+  async def get_daily_forecast_async(self, day: int = 1, units = 'imperial'):
+
+    if  0 <= day <= 7:
+      cached = self.__get_cached(day, units)
+      if cached is not None:
+        return cached['forecast']
+
+      if self.session is None:
+        # Imported on first use, only needed when serving with asyncio
+        import aiohttp
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
 
-      try:
-        forecast['snow'] = self.__mm_to_inch(response['snow'])
-      except KeyError:
-        forecast['snow'] = 0.0
+      async with self.session.get(self.api_url,
+            params=self.__get_query_params(units)) as response:
+        response = (await response.json())['daily'][day]
 
-      return forecast
+      return self.__store_forecast(response, day, units)
 
     else:
       logger.warning("Requested forecast day outside of available range (0-7 days)")
       return "Forecast not found"
+
+  # Close the async HTTP session
+  async def close(self):
+    if self.session is not None:
+      await self.session.close()
+      self.session = None
+
+  # Configure query parameters
+  def __get_query_params(self, units):
+    return {
+      'lat': self.latitude,
+      'lon': self.longitude,
+      # exclude all weather info but daily forecast
+      'exclude': 'current,minutely,hourly,alerts',
+      'appid': self.api_key,
+      'units': units
+    }
+
+  # Parse the daily forecast returned by the API and add it to the cache
+  def __store_forecast(self, response, day, units):
+    forecast = dict()
+
+    forecast['temp_max'] = round(response['temp']['min'], 1)
+    forecast['temp_min'] = round(response['temp']['max'], 1)
+    forecast['wind_speed'] = round(response['wind_speed'], 1)
+    
+    # These values aren't always returned. Set to 0 if not found
+    try:
+      forecast['rain'] = self.__mm_to_inch(response['rain'])
+    except KeyError:
+      forecast['rain'] = 0.0
+
+    try:
+      forecast['snow'] = self.__mm_to_inch(response['snow'])
+    except KeyError:
+      forecast['snow'] = 0.0
+
+    # Drop forecasts cached on previous days
+    today = dt.date.today()
+    self.forecast_cache = {key: value for key, value in self.forecast_cache.items()
+                           if key[0] == today}
+    self.forecast_cache[(today, day, units)] = dict(time=time.time(), forecast=forecast)
+
+    return forecast
   
+  # Return the cached forecast entry for today if it has not expired
+  def __get_cached(self, day, units):
+    cached = self.forecast_cache.get((dt.date.today(), day, units))
+    if cached is None or time.time() - cached['time'] >= self.cache_ttl:
+      return None
+
+    return cached
+
   # mm to inch conversion rounded to two decimal places
   def __mm_to_inch(self, mm):
     return round(mm / 25.4, 2)
\ No newline at end of file